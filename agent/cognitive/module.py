@@ -15,7 +15,8 @@ use_gpu = int(os.getenv('GPU', '-1'))
 
 
 class VVCComponent(brica1.Component):
-    image_feature_count = 1
+    # None uses every camera in the observation
+    image_feature_count = None
     cnn_feature_extractor = CNN_FEATURE_EXTRACTOR
     model = CAFFE_MODEL
     model_type = MODEL_TYPE
@@ -34,8 +35,10 @@ class VVCComponent(brica1.Component):
 
     def fire(self):
         observation = self.get_in_port('Isocortex#V1-Isocortex#VVC-Input').buffer
-        # call feature extractor
-        obs_array = self.feature_extractor.feature(observation, self.image_feature_count)
+        # the server pipeline extracts the feature ahead of the scheduler
+        obs_array = observation.get('feature')
+        if obs_array is None:
+            obs_array = self.feature_extractor.feature(observation, self.image_feature_count)
 
         self.results['Isocortex#VVC-BG-Output'] = obs_array
         self.results['Isocortex#VVC-UB-Output'] = obs_array
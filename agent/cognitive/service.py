@@ -27,6 +27,11 @@ class AgentService:
         self.fl_components = {}     # frontal lobe
         self.mo_components = {}     # motor output
         self.rb_components = {}     # reward generator
+        # frame skip: an action is decided every frame_skips[identifier] frames
+        self.frame_skips = {}
+        self.skip_counts = {}
+        self.last_actions = {}
+        self.skipped_motion = {}    # rotation and movement of the skipped frames
 
     def initialize(self, identifier, agent):
         agent_builder = interpreter.AgentBuilder()
@@ -79,9 +84,38 @@ class AgentService:
 
         self.schedulers[identifier].update()
 
-    def create(self, reward, feature, identifier, agent):
+    def remove(self, identifier):
+        # forgets the identifier; its agent may then serve another one
+        for components in (self.agents, self.schedulers, self.v1_components, self.vvc_components,
+                           self.bg_components, self.ub_components, self.fl_components, self.mo_components,
+                           self.rb_components, self.frame_skips, self.skip_counts, self.last_actions,
+                           self.skipped_motion):
+            components.pop(identifier, None)
+
+    def set_frame_skip(self, identifier, frame_skip):
+        self.frame_skips[identifier] = frame_skip
+        self.skip_counts[identifier] = 0
+        self.skipped_motion[identifier] = (0.0, 0.0)
+        self.bg_components[identifier].agent.set_frame_skip(frame_skip)
+
+    def next_frame_skipped(self, identifier):
+        # advances the frame counter; True when the frame repeats the last action
+        frame_skip = self.frame_skips.get(identifier, 1)
+        if frame_skip <= 1 or identifier not in self.last_actions:
+            return False
+        self.skip_counts[identifier] = (self.skip_counts[identifier] + 1) % frame_skip
+        return self.skip_counts[identifier] != 0
+
+    def skip(self, rotation, movement, identifier):
+        # the reward is cumulative, so the next decided frame sees the reward of the skipped ones
+        skipped_rotation, skipped_movement = self.skipped_motion[identifier]
+        self.skipped_motion[identifier] = (skipped_rotation + rotation, skipped_movement + movement)
+        return self.last_actions[identifier]
+
+    def create(self, reward, feature, identifier, agent, frame_skip=1):
         if identifier not in self.agents:
             self.initialize(identifier, agent)
+        self.set_frame_skip(identifier, frame_skip)
 
         # agent start
         self.bg_components[identifier].get_in_port('Isocortex#VVC-BG-Input').buffer = feature
@@ -92,11 +126,17 @@ class AgentService:
         if app_logger.isEnabledFor(logging.DEBUG):
             app_logger.debug('feature: {}'.format(feature))
 
+        self.last_actions[identifier] = action
         return action
 
     def step(self, reward, rotation, movement, observation, identifier):
         if identifier not in self.agents:
             return str(-1)
+        if identifier in self.skipped_motion:
+            skipped_rotation, skipped_movement = self.skipped_motion[identifier]
+            rotation += skipped_rotation
+            movement += skipped_movement
+            self.skipped_motion[identifier] = (0.0, 0.0)
         self.v1_components[identifier].get_out_port('Isocortex#V1-Isocortex#VVC-Output').buffer = observation
         self.rb_components[identifier].get_out_port('RB-Isocortex#FL-Output').buffer = np.array([reward])
         self.rb_components[identifier].get_out_port('RB-BG-Output').buffer = np.array([reward, rotation, movement, observation])
@@ -104,6 +144,7 @@ class AgentService:
 
         action = self.mo_components[identifier].get_in_port('Isocortex#FL-MO-Input').buffer[0]
 
+        self.last_actions[identifier] = action
         return action
 
     def reset(self, reward, identifier):
@@ -114,5 +155,10 @@ class AgentService:
         self.ub_components[identifier].output(self.ub_components[identifier].last_output_time)
         self.bg_components[identifier].input(self.bg_components[identifier].last_input_time)
         self.bg_components[identifier].end(reward)
+        # the next episode starts with a decided action and a fresh skip cadence
+        self.last_actions.pop(identifier, None)
+        if identifier in self.frame_skips:
+            self.skip_counts[identifier] = 0
+            self.skipped_motion[identifier] = (0.0, 0.0)
 
         return action
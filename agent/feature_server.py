@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Standalone AlexNet (or other backbone) feature service shared by the agent servers of one host.
+
+    python feature_server.py --port 8766
+    python server.py --feature-service http://localhost:8766
+
+Requests from every agent server are batched into shared forward passes, so
+one warm CNN replaces an AlexNet per agent process doing batch-1 inference.
+"""
+import argparse
+
+import cherrypy
+from wsgiref.simple_server import make_server, WSGIServer
+from SocketServer import ThreadingMixIn
+
+import msgpack
+import numpy as np
+
+import logging
+import logging.config
+from config.log import CHERRYPY_ACCESS_LOG, CHERRYPY_ERROR_LOG, LOGGING, APP_KEY
+
+import tensorflow as tf
+from tfalex.backbones import BACKBONES
+from tfalex.batcher import BatchingFeatureExtractor
+from tfalex.cache import FeatureCache
+from tfalex.pool import FeatureExtractorPool
+from serving.decode import DecodeService
+
+logging.config.dictConfig(LOGGING)
+
+app_logger = logging.getLogger(APP_KEY)
+
+
+class ThreadingWsgiServer(ThreadingMixIn, WSGIServer):
+    pass
+
+
+class FeatureRoot(object):
+    def __init__(self, extractor, feature_cache, decoder):
+        self.extractor = extractor
+        self.feature_cache = feature_cache
+        self.decoder = decoder
+
+    def _respond(self, dat):
+        cherrypy.response.headers['Content-Type'] = 'application/x-msgpack'
+        return msgpack.packb(dat)
+
+    @cherrypy.expose
+    def info(self):
+        return self._respond({'out_dim': self.extractor.out_dim, 'in_size': self.extractor.in_size})
+
+    @cherrypy.expose
+    def feature(self):
+        dat = msgpack.unpackb(cherrypy.request.body.read())
+        encoded = dat['image']
+        features = np.empty((len(encoded), self.extractor.out_dim), dtype=np.float32)
+
+        keys = [self.feature_cache.key(data) for data in encoded]
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.feature_cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                features[i] = cached
+        if len(missing) > 0:
+            images, _ = self.decoder.decode([encoded[i] for i in missing], [])
+            features[missing] = self.extractor.image_features(images)
+            for i in missing:
+                self.feature_cache.put(keys[i], features[i].copy())
+
+        return self._respond({'shape': list(features.shape), 'data': features.tobytes()})
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def stats(self):
+        return {'batcher': self.extractor.stats(),
+                'pool': self.extractor.extractor.stats(),
+                'feature_cache': self.feature_cache.stats()}
+
+
+def main(args):
+    cherrypy.config.update({'server.socket_host': args.host, 'server.socket_port': args.port, 'log.screen': False,
+                            'log.access_file': CHERRYPY_ACCESS_LOG, 'log.error_file': CHERRYPY_ERROR_LOG})
+
+    config = tf.ConfigProto(gpu_options=tf.GPUOptions(visible_device_list=args.gpu, allow_growth=True))
+    app_logger.info("loading... {} {}".format(args.backbone, args.cnn_weights or ""))
+    pool = FeatureExtractorPool(args.cnn_replicas, intra_op_threads=args.cnn_threads,
+                                sess_config=config, weights=args.cnn_weights,
+                                backbone=args.backbone)
+    extractor = BatchingFeatureExtractor(pool, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000.0,
+                                         workers=args.cnn_replicas)
+    feature_cache = FeatureCache(args.feature_cache_mb * 1024 * 1024)
+    app_logger.info("done")
+
+    app = cherrypy.tree.mount(FeatureRoot(extractor, feature_cache, DecodeService(args.decode_threads)), '/')
+    server = make_server(args.host, args.port, app, ThreadingWsgiServer)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='LIS Feature Service')
+    parser.add_argument('--host', default='localhost', type=str, help='Server hostname')
+    parser.add_argument('--port', default=8766, type=int, help='Server port number')
+    parser.add_argument('--gpu', default='-1', type=str, help='Gpu id')
+    parser.add_argument('--max-batch', default=16, type=int, help='maximum number of images per forward pass')
+    parser.add_argument('--max-wait-ms', default=5.0, type=float, help='time to wait for a batch to fill')
+    parser.add_argument('--feature-cache-mb', default=256, type=int,
+                        help='memory budget of the camera feature cache, 0 disables it')
+    parser.add_argument('--decode-threads', default=None, type=int,
+                        help='threads decoding the PNGs of a request in parallel, defaults to the cores')
+    parser.add_argument('--cnn-replicas', default=1, type=int, help='number of AlexNet replicas')
+    parser.add_argument('--cnn-threads', default=0, type=int,
+                        help='intra-op threads per AlexNet replica, 0 uses the TensorFlow default')
+    parser.add_argument('--backbone', default='alexnet', choices=sorted(BACKBONES),
+                        help='visual trunk from tfalex/backbones.py; one without pretrained weights needs --cnn-weights')
+    parser.add_argument('--cnn-weights', default=None, type=str,
+                        help='backbone weights: an archive from tool/convert_weights.py, or a pickled .npy, '
+                             'which is read whole even if the layers past the outcome are skipped; defaults '
+                             'to the weights registered with the backbone, as an archive when one sits next to them')
+    args = parser.parse_args()
+
+    main(args)
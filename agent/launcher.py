@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Starts several server.py backends and routes identifiers to them.
+
+Every backend is a separate process with its own TensorFlow sessions,
+agents and DND; serving/router.py pins each identifier to one backend.
+Options not listed below are passed to every server.py unchanged:
+
+    python launcher.py --backends 4 --port 8765 -- --workers 4 --feature-cache-mb 128
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+
+import logging
+import logging.config
+from config.log import LOGGING, APP_KEY
+
+from serving.router import Backend, Router, RouterServer
+from serving.threads import available_cpus, format_cpus, split_cpus
+
+logging.config.dictConfig(LOGGING)
+app_logger = logging.getLogger(APP_KEY)
+
+
+def start_backends(args, server_args):
+    processes = []
+    # disjoint core sets, so that the backends' thread pools do not compete
+    cpu_sets = split_cpus(available_cpus(), args.backends) if args.pin else None
+    for i in range(args.backends):
+        command = [sys.executable, 'server.py',
+                   '--host', args.backend_host,
+                   '--port', str(args.backend_port + i),
+                   '--logdir', os.path.join(args.logdir, 'backend{}'.format(i))] + server_args
+        if cpu_sets is not None:
+            command += ['--cpus', format_cpus(cpu_sets[i])]
+        app_logger.info('starting backend {}: {}'.format(i, ' '.join(command)))
+        processes.append(subprocess.Popen(command))
+    return processes
+
+
+def main(args, server_args):
+    processes = start_backends(args, server_args)
+
+    def stop(signum=None, frame=None):
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+
+    backends = [Backend(args.backend_host, args.backend_port + i) for i in range(args.backends)]
+    router = Router(backends, health_interval=args.health_interval)
+    server = RouterServer((args.host, args.port), router)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='LIS Backend launcher')
+    parser.add_argument('--host', default='localhost', type=str, help='Router hostname')
+    parser.add_argument('--port', default=8765, type=int, help='Router port number')
+    parser.add_argument('--backends', default=2, type=int, help='number of server.py processes')
+    parser.add_argument('--backend-host', default='localhost', type=str, help='hostname the backends bind to')
+    parser.add_argument('--backend-port', default=8800, type=int, help='port of the first backend')
+    parser.add_argument('--logdir', default='board', type=str, help='backend i logs to <logdir>/backend<i>')
+    parser.add_argument('--pin', action='store_true',
+                        help='pin every backend to its own share of the cores; combine with --thread-policy')
+    parser.add_argument('--health-interval', default=2.0, type=float, help='seconds between /health checks')
+    args, server_args = parser.parse_known_args()
+    if len(server_args) > 0 and server_args[0] == '--':
+        server_args = server_args[1:]
+
+    main(args, server_args)
@@ -2,11 +2,12 @@ import build_graph
 import numpy as np
 import tensorflow as tf
 from position_track import PositionTrack
+from sparse import to_batch
 
 
 class Agent:
     def __init__(self, model, dnds, num_actions, name='global', lr=2.5e-4,
-                 gamma=0.99, plotter=None):
+                 gamma=0.99, plotter=None, sparse=False, obs_dim=10240):
         self.num_actions = num_actions
         self.gamma = gamma
         self.t = 0
@@ -19,7 +20,9 @@ class Agent:
             dnds=dnds,
             num_actions=num_actions,
             optimizer=tf.train.RMSPropOptimizer(learning_rate=7e-4, decay=.99, epsilon=0.1),
-            scope=name
+            scope=name,
+            obs_dim=obs_dim,
+            sparse=sparse
         )
 
         self._act = act
@@ -35,6 +38,12 @@ class Agent:
         self.last_reward = None
         self.last_action = None
         self.last_value = None
+        # value estimate of the frame the last action was decided on
+        self.current_value = None
+        # frames per decided action; a transition spans frame_skip frames
+        self.frame_skip = 1
+        # when a list, act_and_train appends its bookkeeping here instead of running it
+        self.deferred = None
 
         self.states = []
         self.rewards = []
@@ -51,6 +60,9 @@ class Agent:
     def set_summary_writer(self, summary_writer):
         self.summary_writer = summary_writer
 
+    def set_frame_skip(self, frame_skip):
+        self.frame_skip = frame_skip
+
     def append_experience(self, action, encode, advantage):
         self.dnds[action].write(encode, advantage)
 
@@ -58,8 +70,10 @@ class Agent:
         actions = np.array(self.actions, dtype=np.uint8)
         returns = []
         R = bootstrap_value
+        # discount per transition, so the horizon in frames does not change with frame_skip
+        gamma = self.gamma ** self.frame_skip
         for r in reversed(self.rewards):
-            R = r + 0.99 * R
+            R = r + gamma * R
             returns.append(R)
         returns = np.array(list(reversed(returns)), dtype=np.float32)
         values = np.array(self.values, dtype=np.float32)
@@ -69,12 +83,22 @@ class Agent:
         for i in range(len(advantages)):
             self.append_experience(actions[i], self.encodes[i], returns[i])
 
-        summary, loss = self._train(self.states, self.initial_state, self.initial_state, self.rotations,
+        summary, loss = self._train(to_batch(self.states), self.initial_state, self.initial_state, self.rotations,
                 self.movements, actions, returns, advantages, self.positions, self.directions, self.position_changes)
         self.summary_writer.add_summary(summary, self.t)
         self._update_local()
         return loss
 
+    def warm_up(self, obs):
+        # runs the act, train and update_local graphs once; the weights change, the caller restores them
+        batch = to_batch([obs])
+        self._act(batch, self.initial_state, self.initial_state, [0.0], [0.0])
+        self._train(batch, self.initial_state, self.initial_state, [0.0], [0.0],
+                    np.zeros(1, dtype=np.uint8), np.zeros(1, dtype=np.float32), np.zeros(1, dtype=np.float32),
+                    np.zeros((1, 3), dtype=np.float32), np.zeros(1, dtype=np.float32),
+                    np.zeros((1, 3), dtype=np.float32))
+        self._update_local()
+
     def act(self, obs):
         normalized_obs = np.zeros((1, 84, 84, 4), dtype=np.float32)
         normalized_obs[0] = np.array(obs, dtype=np.float32) / 255.0
@@ -84,10 +108,12 @@ class Agent:
         return action
 
     def act_and_train(self, obs, reward, rotation, movement, observation):
-        prob, rnn_state, encode = self._act([obs], self.rnn_state0, self.rnn_state1, [rotation], [movement])
+        batch = to_batch([obs])
+        prob, rnn_state, encode, value = self._act(batch, self.rnn_state0, self.rnn_state1, [rotation], [movement])
         action = np.random.choice(range(self.num_actions), p=prob[0])
-
-        value = self._state_value([obs], self.rnn_state0, self.rnn_state1, [rotation], [movement])[0][0]
+        value = value[0][0]
+        self.current_value = value
+        self.rnn_state0, self.rnn_state1 = rnn_state
 
         # plot value
         if self.plotter is not None:
@@ -95,6 +121,15 @@ class Agent:
 
         self.pos_track.step(observation, rotation, movement)
 
+        # the action does not depend on the rollout bookkeeping below
+        if self.deferred is not None:
+            self.deferred.append(lambda: self._record(obs, reward, rotation, movement, action, value, encode))
+        else:
+            self._record(obs, reward, rotation, movement, action, value, encode)
+        return action
+
+    def _record(self, obs, reward, rotation, movement, action, value, encode):
+        # appends the previous transition and trains every 50 of them
         if len(self.states) == 50:
             self.train(self.last_value)
             self.states = []
@@ -121,7 +156,6 @@ class Agent:
             self.position_changes.append(self.last_position_change)
 
         self.t += 1
-        self.rnn_state0, self.rnn_state1 = rnn_state
         self.last_obs = obs
         self.last_reward = reward
         self.last_action = action
@@ -132,7 +166,6 @@ class Agent:
         self.last_position = self.pos_track.get_position()
         self.last_direction = self.pos_track.get_rotation()
         self.last_position_change = self.pos_track.get_velocity()
-        return action
 
     def stop_episode_and_train(self, obs, reward, done=False):
         self.pos_track.reset()
@@ -2,9 +2,12 @@ import tensorflow as tf
 import lightsaber.tensorflow.util as util
 
 
-def build_train(model, dnds, num_actions, optimizer, scope='a3c', reuse=None):
+def build_train(model, dnds, num_actions, optimizer, scope='a3c', reuse=None, obs_dim=10240, sparse=False):
     with tf.variable_scope(scope, reuse=reuse):
-        obs_input = tf.placeholder(tf.float32, [None, 10240], name='obs')
+        if sparse:
+            obs_input = tf.sparse_placeholder(tf.float32, name='obs')
+        else:
+            obs_input = tf.placeholder(tf.float32, [None, obs_dim], name='obs')
         rnn_state_ph0 = tf.placeholder(tf.float32, [1, 258], name='rnn_state0')
         rnn_state_ph1 = tf.placeholder(tf.float32, [1, 258], name='rnn_state1')
         rotate_input = tf.placeholder(tf.float32, [None], name='rotation')
@@ -19,7 +22,8 @@ def build_train(model, dnds, num_actions, optimizer, scope='a3c', reuse=None):
         grid_ph = tf.placeholder(tf.float32, [None, 3], name='grid')
 
         encode, value, state_out, place_cell, head_cell, grid_cell, ca1, hidden_place_cell = model(
-                obs_input, rotate_input, movement_input, rnn_state_tuple, num_actions, scope='model')
+                obs_input, rotate_input, movement_input, rnn_state_tuple, num_actions, scope='model',
+                obs_dim=obs_dim)
 
         place_cell_summary = tf.summary.histogram('{}_place_cell_histogram'.format(scope), hidden_place_cell)
 
@@ -93,7 +97,8 @@ def build_train(model, dnds, num_actions, optimizer, scope='a3c', reuse=None):
 
         state_value = util.function([obs_input, rnn_state_ph0, rnn_state_ph1, rotate_input, movement_input], value)
 
+        # the state value comes with the same run as the policy
         act = util.function(inputs=[obs_input, rnn_state_ph0, rnn_state_ph1,
-                rotate_input, movement_input], outputs=[policy, state_out, concated_encode])
+                rotate_input, movement_input], outputs=[policy, state_out, concated_encode, value])
 
     return act, train, update_local, action_dist, state_value
@@ -9,10 +9,25 @@ def normalized_columns_initializer(std=1.0):
         return tf.constant(out)
     return _initializer
 
-def _make_network(inpt, rotate_inpt, movement_inpt, rnn_state_tuple, num_actions, scope, reuse=None):
+def _sparse_fully_connected(inpt, input_dim, num_outputs, activation_fn):
+    # same variable names as layers.fully_connected so global and local scopes line up
+    with tf.variable_scope('fully_connected'):
+        weights = tf.get_variable('weights', [input_dim, num_outputs],
+                                  initializer=layers.xavier_initializer())
+        biases = tf.get_variable('biases', [num_outputs], initializer=tf.zeros_initializer())
+        out = tf.sparse_tensor_dense_matmul(inpt, weights) + biases
+    return activation_fn(out)
+
+def _make_network(inpt, rotate_inpt, movement_inpt, rnn_state_tuple, num_actions, scope, reuse=None,
+                  obs_dim=None):
     with tf.variable_scope(scope, reuse=reuse):
         out = inpt
-        conv_out = layers.fully_connected(out, 256, activation_fn=tf.nn.relu)
+        if isinstance(inpt, tf.SparseTensor):
+            conv_out = _sparse_fully_connected(out, obs_dim, 256, activation_fn=tf.nn.relu)
+            step_size = tf.cast(inpt.dense_shape[:1], tf.int32)
+        else:
+            conv_out = layers.fully_connected(out, 256, activation_fn=tf.nn.relu)
+            step_size = tf.shape(inpt)[:1]
 
         rotate_inpt = tf.expand_dims(rotate_inpt, 1)
         movement_inpt = tf.expand_dims(movement_inpt, 1)
@@ -22,7 +37,6 @@ def _make_network(inpt, rotate_inpt, movement_inpt, rnn_state_tuple, num_actions
             lstm_cell = tf.contrib.rnn.BasicLSTMCell(258, state_is_tuple=True)
 
             rnn_in = tf.expand_dims(out, [0])
-            step_size = tf.shape(inpt)[:1]
             lstm_outputs, lstm_state = tf.nn.dynamic_rnn(
                     lstm_cell, rnn_in, initial_state=rnn_state_tuple,
                     sequence_length=step_size, time_major=False)
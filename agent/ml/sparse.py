@@ -0,0 +1,66 @@
+import numpy as np
+import tensorflow as tf
+
+
+class SparseFeature(object):
+    '''Non-zero entries of a dense feature vector.
+
+    pool5 comes out of a ReLU, so most of its 9216 entries are zero. Only the
+    indices and values of the non-zero entries are kept, which is what the
+    rollout stores and what the sparse input layer consumes.
+    '''
+
+    def __init__(self, indices, values, dim):
+        self.indices = indices
+        self.values = values
+        self.dim = dim
+
+    @classmethod
+    def from_dense(cls, dense):
+        dense = np.asarray(dense, dtype=np.float32).reshape(-1)
+        indices = np.flatnonzero(dense).astype(np.int32)
+        return cls(indices, dense[indices], dense.shape[0])
+
+    def to_dense(self):
+        dense = np.zeros(self.dim, dtype=np.float32)
+        dense[self.indices] = self.values
+        return dense
+
+    def copy(self):
+        return SparseFeature(self.indices.copy(), self.values.copy(), self.dim)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    @property
+    def density(self):
+        return self.nnz / float(self.dim)
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.values.nbytes
+
+    def __len__(self):
+        return self.dim
+
+
+def stack(features):
+    '''Builds a batch feedable to a sparse placeholder from SparseFeature rows.'''
+    rows = [np.full(f.nnz, i, dtype=np.int64) for i, f in enumerate(features)]
+    indices = np.zeros((sum(f.nnz for f in features), 2), dtype=np.int64)
+    if len(rows) > 0:
+        indices[:, 0] = np.concatenate(rows)
+        indices[:, 1] = np.concatenate([f.indices for f in features])
+        values = np.concatenate([f.values for f in features])
+    else:
+        values = np.zeros(0, dtype=np.float32)
+    dim = features[0].dim if len(features) > 0 else 0
+    return tf.SparseTensorValue(indices, values, np.array([len(features), dim], dtype=np.int64))
+
+
+def to_batch(observations):
+    '''Returns the feed value for the obs placeholder, dense or sparse.'''
+    if len(observations) > 0 and isinstance(observations[0], SparseFeature):
+        return stack(observations)
+    return observations
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import argparse
-import io
+import multiprocessing
 import os
-from threading import Lock
+import time
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Event, Lock, Thread
 
 import cherrypy
 from wsgiref.simple_server import make_server, WSGIServer
@@ -10,13 +12,14 @@ from SocketServer import ThreadingMixIn
 
 import msgpack
 import numpy as np
-from PIL import Image
-from PIL import ImageOps
 
 from config import BRICA_CONFIG_FILE
-from config.model import TF_CNN_FEATURE_EXTRACTOR
 
-from tfalex.FeatureExtractor import FeatureExtractor
+from tfalex.backbones import BACKBONES, get_backbone
+from tfalex.pool import FeatureExtractorPool
+from tfalex.remote import RemoteFeatureExtractor
+from tfalex.cache import FeatureCache
+from ml.sparse import SparseFeature
 from tool.visualizer import AnimatedLineGraph
 
 import logging
@@ -24,6 +27,13 @@ import logging.config
 from config.log import CHERRYPY_ACCESS_LOG, CHERRYPY_ERROR_LOG, LOGGING, APP_KEY, INBOUND_KEY, OUTBOUND_KEY
 from cognitive.service import AgentService
 from tool.result_logger import ResultLogger
+from tool.recorder import PayloadRecorder
+from serving.decode import DecodeService
+from serving.agent_pool import AgentPool, PoolExhausted
+from serving.pipeline import Pipeline, Stage, WorkerPool
+from serving.protocol import PAYLOAD_FORMATS, response_format
+from serving.stream import StreamServer
+from serving.threads import POLICIES, ThreadPlan, parse_cpus, pin
 
 import tensorflow as tf
 from ml.agent import Agent
@@ -42,20 +52,95 @@ class ThreadingWsgiServer(ThreadingMixIn, WSGIServer):
     pass
 
 
-def unpack(payload, depth_image_count=1, depth_image_dim=32*32):
-    dat = msgpack.unpackb(payload)
+serial_decoder = DecodeService(workers=0)
+
+
+def unpack(payload, depth_image_count=None, depth_image_dim=32*32, feature_cache=None, decode_images=True,
+           decoder=None):
+    return unpack_message(msgpack.unpackb(payload), depth_image_count, depth_image_dim, feature_cache,
+                          decode_images, decoder)
+
+
+def unpack_message(dat, depth_image_count=None, depth_image_dim=32*32, feature_cache=None, decode_images=True,
+                   decoder=None):
+    # dat: the msgpack map of one observation
+    # any number of image/depth pairs, one per camera
+    if depth_image_count is None:
+        depth_image_count = len(dat['image'])
+    if decoder is None:
+        decoder = serial_decoder
+
+    # cached camera images are not decoded; FeatureExtractor uses their cached features
+    encoded = []
+    image_keys = []
+    image_features = []
+    for i in xrange(depth_image_count):
+        cached = None
+        if feature_cache is not None and feature_cache.enabled:
+            key = feature_cache.key(dat['image'][i])
+            cached = feature_cache.get(key)
+            image_keys.append(key)
+        image_features.append(cached)
+        encoded.append(dat['image'][i] if cached is None else None)
+
+    if decode_images:
+        image, depth = decoder.decode(encoded, dat['depth'][:depth_image_count])
+    else:
+        # left encoded for RemoteFeatureExtractor
+        image, depth = decoder.decode([], dat['depth'][:depth_image_count])
+        image = encoded
+
+    reward = dat['reward']
+    observation = {"image": image, "depth": depth, "image_features": image_features}
+    if len(image_keys) > 0:
+        observation["image_keys"] = image_keys
+    rotation = dat['rotation']
+    movement = dat['movement']
+    scene_num = dat['scene_num']
+
+    return reward, observation, rotation, movement, scene_num
+
+
+def unpack_raw(payload, depth_image_count=None, depth_image_dim=32*32, feature_cache=None):
+    return unpack_raw_message(msgpack.unpackb(payload), depth_image_count, depth_image_dim, feature_cache)
+
+
+def unpack_raw_message(dat, depth_image_count=None, depth_image_dim=32*32, feature_cache=None):
+    # image and depth carry raw pixels described by image_shape/depth_shape and dtype;
+    # the arrays are read-only views over the msgpack bytes, no PNG involved
+    if depth_image_count is None:
+        depth_image_count = len(dat['image'])
+    dtype = np.dtype(dat.get('dtype', 'uint8'))
+    image_shape = tuple(dat['image_shape'])
+    depth_shape = tuple(dat['depth_shape'])
+    if dtype != np.uint8 or len(image_shape) != 3 or image_shape[2] != 3:
+        raise ValueError('raw images must be uint8 (height, width, 3), got {} {}'.format(dtype, image_shape))
 
     image = []
+    image_keys = []
+    image_features = []
     for i in xrange(depth_image_count):
-        image.append(Image.open(io.BytesIO(bytearray(dat['image'][i]))))
+        cached = None
+        if feature_cache is not None and feature_cache.enabled:
+            key = feature_cache.key(dat['image'][i])
+            cached = feature_cache.get(key)
+            image_keys.append(key)
+        image_features.append(cached)
+        image.append(np.frombuffer(dat['image'][i], dtype=dtype).reshape(image_shape) if cached is None else None)
 
     depth = []
     for i in xrange(depth_image_count):
-        d = (Image.open(io.BytesIO(bytearray(dat['depth'][i]))))
-        depth.append(np.array(ImageOps.grayscale(d)).reshape(depth_image_dim))
+        d = np.frombuffer(dat['depth'][i], dtype=dtype).reshape(depth_shape)
+        if d.ndim == 3:
+            # same ITU-R 601 luma as PIL's convert('L')
+            d = d.astype(np.uint32)
+            d = ((d[..., 0] * 19595 + d[..., 1] * 38470 + d[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
+        depth.append(d.reshape(depth_image_dim))
 
     reward = dat['reward']
-    observation = {"image": image, "depth": depth}
+    observation = {"image": image, "depth": depth, "image_features": image_features}
+    if len(image_keys) > 0:
+        observation["image_keys"] = image_keys
     rotation = dat['rotation']
     movement = dat['movement']
     scene_num = dat['scene_num']
@@ -82,141 +167,597 @@ image_feature_count = 1
 feature_output_dim = (depth_image_dim * depth_image_count) + (image_feature_dim * image_feature_count)
 
 
+def observation_dim(cameras, image_feature_dim=image_feature_dim):
+    # every camera contributes one image feature and one depth image
+    return (depth_image_dim + image_feature_dim) * cameras
+
+
+class StageRequest(object):
+    '''A create/step request as it moves through the decode, CNN and policy stages.'''
+
+    def __init__(self, kind, identifier, body, agent=None, payload_format='png', message=None, frame_skip=1):
+        self.kind = kind
+        self.identifier = identifier
+        self.body = body
+        # already unpacked msgpack map, used instead of body (records of /step_batch)
+        self.message = message
+        # frames per decided action, set at create
+        self.frame_skip = frame_skip
+        self.agent = agent
+        self.payload_format = payload_format
+        self.reward = None
+        self.observation = None
+        self.rotation = None
+        self.movement = None
+        self.scene_num = None
+        # seconds per stage: decode, cnn, policy and train (part of policy)
+        self.timing = {}
+        self.value = None
+        # bookkeeping run after the response: logging and the agent's rollout and training
+        self.deferred = []
+
+
 class Root(object):
-    def __init__(self, sess, logdir, num_workers, visualize):
+    def __init__(self, sess, logdir, num_workers, visualize, sparse=False, record_dir=None,
+                 cnn_weights=None, cameras=image_feature_count,
+                 feature_cache_mb=0, cnn_replicas=1, cnn_threads=0, feature_service=None,
+                 backbone='alexnet',
+                 decode_workers=2, cnn_workers=None, policy_workers=None, stage_queue_size=16,
+                 decode_threads=None, deferred_workers=None,
+                 max_workers=None, idle_timeout=None, admission_timeout=10.0, session_concurrency=None,
+                 warm_up=True):
         self.latest_stage = -1
+        # set once the warm-up pass is done; until then /health and the handlers answer 503
+        self.ready = Event()
+        self.warm_up_seconds = None
+        self.warm_up_error = None
+        # the synthetic feature of the startup warm-up, reused to warm up agents built on demand
+        self.warm_up_feature = None
+        self.stage_lock = Lock()
+        # graph construction is not thread-safe; agents built on demand are built one at a time
+        self.build_lock = Lock()
         self.sess = sess
+        self.session_concurrency = session_concurrency or multiprocessing.cpu_count()
+        self.session_slots = BoundedSemaphore(self.session_concurrency)
+        self.decoder = DecodeService(decode_threads)
+        self.feature_cache = FeatureCache(feature_cache_mb * 1024 * 1024)
+        self.recorder = PayloadRecorder(record_dir) if record_dir is not None else None
         with sess.as_default():
-            model = make_network()
-            dnds = []
-            for i in range(3):
-                dnds.append(DND())
-            global_agent = Agent(model, dnds, 3, name='global')
-
-            self.agents = []
-            self.popped_agents = {}
-            self.popped_locks = {}
-
-            # CREATE NEW AGENT(S)
-            for i in range(num_workers):
-                # CREATE PLOTTER PER AGENT
-                plotter = (AnimatedLineGraph(0, 0, max_val=50)
-                           if visualize else None)
-
-                self.agents.append(Agent(model, dnds, 3,
-                                         name='worker{}'.format(i),
-                                         plotter=plotter)
-                                   )
-            summary_writer = tf.summary.FileWriter(logdir, sess.graph)
-            for agent in self.agents:
-                agent.set_summary_writer(summary_writer)
-            initialize()
+            # load feature extractor (alex net or another backbone)
+            self.decode_images = feature_service is None
+            if cnn_weights is None:
+                cnn_weights = get_backbone(backbone).weights
+            if feature_service is not None:
+                app_logger.info("connecting... {}".format(feature_service))
+                self.feature_extractor = RemoteFeatureExtractor(feature_service,
+                                                                sparse=sparse,
+                                                                feature_cache=self.feature_cache)
+                app_logger.info("done")
 
-            # load feature extractor (alex net)
-            if os.path.exists(TF_CNN_FEATURE_EXTRACTOR):
+            elif cnn_weights is None or os.path.exists(cnn_weights):
                 config = tf.ConfigProto(gpu_options=tf.GPUOptions(visible_device_list='0', allow_growth=True))
                 gpu_config =  config # TODO: remove this
-                app_logger.info("loading... {}".format(TF_CNN_FEATURE_EXTRACTOR))
-                self.feature_extractor = FeatureExtractor(sess_name='AlexNet',
-                                                          sess_config=gpu_config)
+                app_logger.info("loading... {}".format(cnn_weights))
+                self.feature_extractor = FeatureExtractorPool(cnn_replicas,
+                                                              intra_op_threads=cnn_threads,
+                                                              sess_config=gpu_config,
+                                                              sparse=sparse,
+                                                              weights=cnn_weights,
+                                                              feature_cache=self.feature_cache,
+                                                              backbone=backbone)
                 app_logger.info("done")
 
             else:
                 raise Exception
 
+            self.model = make_network()
+            self.dnds = []
+            for i in range(3):
+                self.dnds.append(DND())
+            self.cameras = cameras
+            self.obs_dim = observation_dim(cameras, self.feature_extractor.out_dim)
+            self.sparse = sparse
+            self.visualize = visualize
+            self.summary_writer = None
+            self.initialized = False
+            global_agent = Agent(self.model, self.dnds, 3, name='global', sparse=sparse, obs_dim=self.obs_dim)
+
+            # CREATE NEW AGENT(S): num_workers now, more on demand up to max_workers
+            self.agent_pool = AgentPool(self._build_agent, self._reclaim_agent,
+                                        initial=num_workers,
+                                        max_agents=max_workers,
+                                        idle_timeout=idle_timeout,
+                                        admission_timeout=admission_timeout)
+            self.summary_writer = tf.summary.FileWriter(logdir, sess.graph)
+            for agent in self.agent_pool.free:
+                agent.set_summary_writer(self.summary_writer)
+            initialize()
+            self.initialized = True
+
             self.agent_service = AgentService(BRICA_CONFIG_FILE, self.feature_extractor, sess)
             self.result_logger = ResultLogger()
 
-    @cherrypy.expose()
-    def flush(self, identifier):
-        if identifier not in self.popped_agents:
-            if len(self.agents) > 0:
-                self.popped_locks[identifier] = Lock()
-                agent = self.agents.pop(0)
-                self.popped_agents[identifier] = agent
-                self.agent_service.initialize(identifier, agent)
-            else:
-                return
+        # runs the deferred work of a request and then releases its agent; 0 runs it before responding
+        self.deferred_pool = WorkerPool(deferred_workers if deferred_workers is not None else num_workers,
+                                        name='deferred')
+
+        # decode of one frame overlaps the CNN pass and the policy of others
+        self.pipeline = Pipeline([
+            Stage('decode', self._decode, decode_workers, stage_queue_size),
+            Stage('cnn', self._extract, cnn_workers or cnn_replicas, stage_queue_size),
+            Stage('policy', self._policy, policy_workers or num_workers, stage_queue_size),
+        ])
+
+        if warm_up:
+            warm_up_thread = Thread(target=self._warm_up, name='warm-up')
+            warm_up_thread.daemon = True
+            warm_up_thread.start()
         else:
-            agent = self.popped_agents[identifier]
-        self.popped_locks[identifier].acquire()
-        with self.sess.as_default():
-            self.agent_service.initialize(identifier, agent)
-        self.popped_locks[identifier].release()
+            self.ready.set()
+
+    @contextmanager
+    def _session(self):
+        # at most session_concurrency threads run the A3C graph at once, however many request threads there are
+        with self.session_slots:
+            with self.sess.as_default():
+                yield
+
+    @contextmanager
+    def _exclusive_session(self):
+        # every slot, so no other thread runs the A3C graph; taken under the build lock only,
+        # so that two threads never hold part of the slots each
+        for _ in range(self.session_concurrency):
+            self.session_slots.acquire()
+        try:
+            with self.sess.as_default():
+                yield
+        finally:
+            for _ in range(self.session_concurrency):
+                self.session_slots.release()
+
+    def _update_stage(self, scene_num):
+        with self.stage_lock:
+            self.latest_stage = max(scene_num, self.latest_stage)
 
-    @cherrypy.expose
-    def create(self, identifier):
-        if identifier not in self.popped_agents:
-            if __debug__:
-                os.system('spd-say "Agent Created"')
-            if len(self.agents) > 0:
-                self.popped_locks[identifier] = Lock()
-                agent = self.agents.pop(0)
-                self.popped_agents[identifier] = agent
-            else:
-                return
+    def _build_agent(self, index):
+        with self.build_lock:
+            with self._session():
+                # CREATE PLOTTER PER AGENT
+                plotter = (AnimatedLineGraph(0, 0, max_val=50)
+                           if self.visualize else None)
+                agent = Agent(self.model, self.dnds, 3,
+                              name='worker{}'.format(index),
+                              plotter=plotter,
+                              sparse=self.sparse,
+                              obs_dim=self.obs_dim)
+                if self.initialized:
+                    # an agent added while serving starts from the current global weights
+                    agent.set_summary_writer(self.summary_writer)
+                    uninitialized = set(self.sess.run(tf.report_uninitialized_variables()))
+                    self.sess.run(tf.variables_initializer(
+                        [v for v in tf.global_variables() if v.op.name in uninitialized]))
+                    agent._update_local()
+            if self.initialized:
+                if self.warm_up_feature is not None:
+                    # otherwise its first create and first train pay the kernel setup of the new graph
+                    try:
+                        self._warm_up_agents([agent], self.warm_up_feature)
+                    except Exception:
+                        app_logger.exception('warm-up of worker{} failed'.format(index))
+                app_logger.info('built agent worker{}'.format(index))
+        return agent
+
+    def _synthetic_feature(self):
+        # a random-pixel observation through every AlexNet replica; its feature feeds the agent warm-up
+        if not self.decode_images:
+            feature = np.zeros(self.obs_dim, dtype=np.float32)
+            return SparseFeature.from_dense(feature) if self.sparse else feature
+        random = np.random.RandomState(0)
+        size = self.feature_extractor.in_size
+        observation = {
+            'image': [random.randint(0, 256, (size, size, 3)).astype(np.uint8) for _ in range(self.cameras)],
+            'depth': [random.rand(depth_image_dim).astype(np.float32) for _ in range(self.cameras)],
+        }
+        for extractor in getattr(self.feature_extractor, 'replicas', [self.feature_extractor]):
+            feature = extractor.feature(observation)
+        return feature
+
+    def _warm_up(self):
+        '''Runs every hot graph once before the first client connects.
+
+        The first run of a graph pays for TensorFlow's kernel setup, the first
+        train for the gradient ops. The weights, optimizer slots and DNDs are
+        restored afterwards, so the warm-up leaves no trace in training.
+        '''
+        start = time.time()
+        try:
+            feature = self._synthetic_feature()
+            with self.build_lock:
+                self._warm_up_agents(list(self.agent_pool.free), feature)
+            self.warm_up_feature = feature
+            self.warm_up_seconds = time.time() - start
+            app_logger.info('warmed up in {:.1f}s'.format(self.warm_up_seconds))
+        except Exception as e:
+            # serve cold rather than not at all
+            self.warm_up_error = '{}: {}'.format(type(e).__name__, e)
+            app_logger.exception('warm-up failed')
+        finally:
+            self.ready.set()
+
+    def _warm_up_agents(self, agents, feature):
+        '''Runs act, train and update_local of the agents once and restores the weights and DNDs.
+        The caller holds the build lock; no other thread runs the graph meanwhile, so
+        the snapshot cannot drop the training of other workers.
+        '''
+        with self._exclusive_session():
+            variables = tf.global_variables()
+            values = self.sess.run(variables)
+            memories = [(list(dnd.memory_keys), list(dnd.memory_values), dnd.ages.copy()) for dnd in self.dnds]
+            try:
+                for agent in agents:
+                    agent.warm_up(feature)
+            finally:
+                for variable, value in zip(variables, values):
+                    variable.load(value, self.sess)
+                for dnd, (keys, memory_values, ages) in zip(self.dnds, memories):
+                    dnd.memory_keys, dnd.memory_values, dnd.ages = keys, memory_values, ages
+
+    def _reclaim_agent(self, identifier, agent):
+        # train on the partial rollout of the idle identifier and forget it
+        with self._session():
+            if agent.last_reward is not None:
+                agent.stop_episode_and_train(None, agent.last_reward)
+            agent.stop_episode()
+        self.agent_service.remove(identifier)
+
+    def _record_payload(self, request):
+        if self.recorder is None:
+            return
+        # the records of a step_batch arrive unpacked; they are stored as single step bodies
+        body = request.body if request.body is not None else msgpack.packb(request.message)
+        self.recorder.record(request.identifier, request.kind, body)
+
+    def _decode(self, request):
+        start = time.time()
+        self._record_payload(request)
+        message = request.message if request.message is not None else msgpack.unpackb(request.body)
+        if request.payload_format == 'raw':
+            unpacked = unpack_raw_message(message, feature_cache=self.feature_cache)
         else:
-            agent = self.popped_agents[identifier]
-        self.popped_locks[identifier].acquire()
-        with self.sess.as_default():
-            body = cherrypy.request.body.read()
-            reward, observation, rotation, movement, scene_num = unpack(body)
-            self.latest_stage = max(scene_num, self.latest_stage)
+            unpacked = unpack_message(message, feature_cache=self.feature_cache,
+                                      decode_images=self.decode_images, decoder=self.decoder)
+        request.reward, request.observation, request.rotation, request.movement, request.scene_num = unpacked
+        request.body = None
+        request.message = None
+        self._update_stage(request.scene_num)
+
+        request.deferred.append(lambda: inbound_logger.info('id: {}, reward: {}, depth: {}'.format(
+            request.identifier, request.reward, request.observation['depth']
+        )))
+        request.timing['decode'] = time.time() - start
+        return request
+
+    def _extract(self, request):
+        start = time.time()
+        # VVCComponent uses the precomputed feature instead of running the CNN itself
+        request.observation['feature'] = self.feature_extractor.feature(request.observation)
+        request.timing['cnn'] = time.time() - start
+        return request
+
+    def _policy(self, request):
+        start = time.time()
+        with self._session():
+            if request.kind == 'create':
+                self.result_logger.initialize()
+                result = self.agent_service.create(request.reward, request.observation['feature'],
+                                                   request.identifier, request.agent, request.frame_skip)
+                request.deferred.append(lambda: outbound_logger.info('id:{}, action: {}'.format(
+                    request.identifier, result)))
+            else:
+                agent = self.agent_pool.get(request.identifier)
+                if agent is not None:
+                    # the rollout append and training of act_and_train run after the response
+                    agent.deferred = request.deferred
+                try:
+                    result = self.agent_service.step(request.reward, request.rotation, request.movement,
+                                                     request.observation, request.identifier)
+                finally:
+                    if agent is not None:
+                        agent.deferred = None
+                request.deferred.append(self.result_logger.step)
+                request.deferred.append(lambda: outbound_logger.info('id: {}, result: {}'.format(
+                    request.identifier, result
+                )))
+                if agent is not None:
+                    request.value = agent.current_value
+        request.timing['policy'] = time.time() - start
+        return result
+
+    def _run_deferred(self, tasks, locks):
+        try:
+            with self._session():
+                for task in tasks:
+                    task()
+        except Exception:
+            app_logger.exception('deferred work failed')
+        finally:
+            # the agents accept their next frame only once their bookkeeping is done
+            for lock in locks:
+                lock.release()
+
+    def _skip(self, request):
+        # repeats the last action: only the scalars are read, no decode, CNN or policy
+        self._record_payload(request)
+        message = request.message if request.message is not None else msgpack.unpackb(request.body)
+        self._update_stage(message['scene_num'])
+        result = self.agent_service.skip(message['rotation'], message['movement'], request.identifier)
+        request.deferred.append(self.result_logger.step)
+        request.deferred.append(lambda: outbound_logger.info('id: {}, result: {} (skipped frame)'.format(
+            request.identifier, result)))
+        return result
+
+    def _respond(self, request, result, response_format):
+        if response_format == 'text':
+            if request.kind == 'create':
+                return str(result)
+            return str(result) + "/" + str(self.latest_stage)
+        return msgpack.packb({
+            'action': int(result),
+            'stage': self.latest_stage,
+            'value': float(request.value) if request.value is not None else None,
+            # milliseconds spent on this frame; training runs after the response and is not included
+            'timing': dict((name, 1000.0 * elapsed) for name, elapsed in request.timing.items()),
+        })
+
+    def check_payload_format(self, payload_format):
+        if payload_format not in PAYLOAD_FORMATS:
+            raise ValueError('unknown payload format: {}'.format(payload_format))
+        if payload_format == 'raw' and not self.decode_images:
+            # the feature service takes encoded PNGs only
+            raise ValueError('raw payloads are not supported with --feature-service')
+        return payload_format
+
+    # handle_* are independent of the HTTP front end; they return the response body
+
+    def handle_flush(self, identifier):
+        agent, _, lock = self.agent_pool.hold(identifier, create=True)
+        try:
+            with self._session():
+                self.agent_service.initialize(identifier, agent)
+        finally:
+            lock.release()
+
+    def handle_create(self, identifier, body, payload_format='png', response_format='text', frame_skip=1):
+        '''frame_skip: the action decided on one frame is repeated on the next frame_skip - 1 frames'''
+        self.check_payload_format(payload_format)
+        if frame_skip < 1:
+            raise ValueError('frame_skip must be positive')
+        # waits for a free agent; PoolExhausted when none frees up in time
+        agent, new, lock = self.agent_pool.hold(identifier, create=True)
+        if new and __debug__:
+            os.system('spd-say "Agent Created"')
+        request = StageRequest('create', identifier, body, agent, payload_format, frame_skip=frame_skip)
+        try:
+            result = self.pipeline.run(request)
+        except Exception:
+            lock.release()
+            raise
+        self.deferred_pool.submit(self._run_deferred, request.deferred, [lock])
+        return self._respond(request, result, response_format)
+
+    def handle_step(self, identifier, body, payload_format='png', response_format='text'):
+        self.check_payload_format(payload_format)
+        request = StageRequest('step', identifier, body, payload_format=payload_format)
+        _, _, lock = self.agent_pool.hold(identifier)
+        locks = [lock] if lock is not None else []
+        try:
+            if self.agent_service.next_frame_skipped(identifier):
+                result = self._skip(request)
+            else:
+                result = self.pipeline.run(request)
+        except Exception:
+            for lock in locks:
+                lock.release()
+            raise
+        # the lock is released by the deferred work, which keeps the frames of an agent in order
+        self.deferred_pool.submit(self._run_deferred, request.deferred, locks)
+        return self._respond(request, result, response_format)
+
+    def handle_step_batch(self, body, payload_format='png'):
+        '''Steps many agents with one request.
+        body: msgpack list of step messages, each with an additional 'identifier'
+        returns msgpack {'actions': [action per record], 'stage': latest stage}
+        '''
+        self.check_payload_format(payload_format)
+        messages = msgpack.unpackb(body)
+        identifiers = [message['identifier'] for message in messages]
+        if len(set(identifiers)) != len(identifiers):
+            raise ValueError('an identifier may appear only once per batch')
+        requests = [StageRequest('step', identifier, None, payload_format=payload_format, message=message)
+                    for identifier, message in zip(identifiers, messages)]
+
+        # sorted, so that two batches sharing agents cannot deadlock
+        locks = [self.agent_pool.hold(identifier)[2] for identifier in sorted(identifiers)]
+        locks = [lock for lock in locks if lock is not None]
+        results = {}
+        errors = []
+        pending = []
+        try:
+            decided = []
+            for request in requests:
+                if self.agent_service.next_frame_skipped(request.identifier):
+                    results[request.identifier] = self._skip(request)
+                else:
+                    decided.append(request)
+            for request in decided:
+                pending.append((request, self.pipeline.submit(request, last='decode')))
+            errors = self._wait_all(pending, {})
+            pending = []
+            if len(errors) == 0:
+                # one forward pass for the cameras of every record
+                features = self.feature_extractor.features([request.observation for request in decided])
+                for request, feature in zip(decided, features):
+                    request.observation['feature'] = feature
+                for request in decided:
+                    pending.append((request, self.pipeline.submit(request, first='policy')))
+                errors = self._wait_all(pending, results)
+                pending = []
+        except Exception as e:
+            errors = [e] + self._wait_all(pending, results)
+        # no stage touches the agents any more; the records that were stepped keep their rollout
+        # bookkeeping even when others failed, and the locks are released after it
+        self.deferred_pool.submit(self._run_deferred, [task for request in requests for task in request.deferred],
+                                  locks)
+        if len(errors) > 0:
+            raise errors[0]
+        return msgpack.packb({'actions': [int(results[identifier]) for identifier in identifiers],
+                              'stage': self.latest_stage})
+
+    @staticmethod
+    def _wait_all(pending, results):
+        # waits for every (request, future), also after one failed; returns the errors
+        errors = []
+        for request, future in pending:
+            try:
+                results[request.identifier] = future.result()
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def handle_reset(self, identifier, body):
+        _, _, lock = self.agent_pool.hold(identifier)
+        try:
+            with self._session():
+                reward, success, failure, elapsed, finished = unpack_reset(body)
+
+                inbound_logger.info('reward: {}, success: {}, failure: {}, elapsed: {}'.format(
+                    reward, success, failure, elapsed))
+
+                result = self.agent_service.reset(reward, identifier)
+                self.result_logger.report(success, failure, finished)
+
+                outbound_logger.info('result: {}'.format(result))
+        finally:
+            if lock is not None:
+                lock.release()
+        return str(result)
 
-            inbound_logger.info('id: {}, reward: {}, depth: {}'.format(
-                identifier, reward, observation['depth']
-            ))
-            feature = self.feature_extractor.feature(observation)
-            self.result_logger.initialize()
-            result = self.agent_service.create(reward, feature, identifier, agent)
+    def stats(self):
+        # queue depth and mean wait/service time of every pipeline stage
+        return {'stages': self.pipeline.stats(), 'feature_cache': self.feature_cache.stats(),
+                'agents': self.agent_pool.stats()}
 
-            outbound_logger.info('id:{}, action: {}'.format(identifier, result))
-        self.popped_locks[identifier].release()
-        return str(result)
+    def health_status(self):
+        ready = self.ready.is_set()
+        return {'status': 'ok' if ready else 'warming up', 'ready': ready,
+                'warm_up_seconds': self.warm_up_seconds, 'warm_up_error': self.warm_up_error,
+                'agents': self.agent_pool.stats()}
+
+    def _require_ready(self):
+        if not self.ready.is_set():
+            raise cherrypy.HTTPError(503, 'warming up')
+
+    def _payload_format(self):
+        payload_format = cherrypy.request.headers.get('X-LIS-Payload', 'png').lower()
+        try:
+            return self.check_payload_format(payload_format)
+        except ValueError as e:
+            raise cherrypy.HTTPError(415, str(e))
+
+    @cherrypy.expose()
+    def flush(self, identifier):
+        self._require_ready()
+        try:
+            self.handle_flush(identifier)
+        except PoolExhausted as e:
+            raise cherrypy.HTTPError(503, str(e))
+
+    def _response_format(self, requested):
+        try:
+            negotiated = response_format(cherrypy.request.headers.get('Accept'), requested)
+        except ValueError as e:
+            raise cherrypy.HTTPError(406, str(e))
+        if negotiated == 'msgpack':
+            cherrypy.response.headers['Content-Type'] = 'application/x-msgpack'
+        return negotiated
 
     @cherrypy.expose
-    def step(self, identifier):
-        if identifier in self.popped_locks:
-            self.popped_locks[identifier].acquire()
-        with self.sess.as_default():
-            body = cherrypy.request.body.read()
-            reward, observation, rotation, movement, scene_num = unpack(body)
-            self.latest_stage = max(scene_num, self.latest_stage)
+    def create(self, identifier, format=None, frame_skip=1):
+        try:
+            frame_skip = int(frame_skip)
+            if frame_skip < 1:
+                raise ValueError
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'frame_skip must be a positive integer')
+        self._require_ready()
+        try:
+            return self.handle_create(identifier, cherrypy.request.body.read(), self._payload_format(),
+                                      self._response_format(format), frame_skip)
+        except PoolExhausted as e:
+            raise cherrypy.HTTPError(503, str(e))
 
-            inbound_logger.info('id: {}, reward: {}, depth: {}'.format(
-                identifier, reward, observation['depth']
-            ))
+    @cherrypy.expose
+    def step(self, identifier, format=None):
+        self._require_ready()
+        return self.handle_step(identifier, cherrypy.request.body.read(), self._payload_format(),
+                                self._response_format(format))
 
-            result = self.agent_service.step(reward, rotation, movement, observation, identifier)
-            self.result_logger.step()
-            outbound_logger.info('id: {}, result: {}'.format(
-                identifier, result
-            ))
-        if identifier in self.popped_locks:
-            self.popped_locks[identifier].release()
-        return str(result) + "/" + str(self.latest_stage)
+    @cherrypy.expose
+    def step_batch(self):
+        self._require_ready()
+        body = cherrypy.request.body.read()
+        payload_format = self._payload_format()
+        try:
+            result = self.handle_step_batch(body, payload_format)
+        except (ValueError, KeyError) as e:
+            raise cherrypy.HTTPError(400, str(e))
+        cherrypy.response.headers['Content-Type'] = 'application/x-msgpack'
+        return result
 
     @cherrypy.expose
-    def reset(self, identifier):
-        if identifier in self.popped_locks:
-            self.popped_locks[identifier].acquire()
-        with self.sess.as_default():
-            body = cherrypy.request.body.read()
-            reward, success, failure, elapsed, finished = unpack_reset(body)
+    @cherrypy.tools.json_out()
+    def feature_cache_stats(self):
+        return self.feature_cache.stats()
 
-            inbound_logger.info('reward: {}, success: {}, failure: {}, elapsed: {}'.format(
-                reward, success, failure, elapsed))
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def metrics(self):
+        return self.stats()
 
-            result = self.agent_service.reset(reward, identifier)
-            self.result_logger.report(success, failure, finished)
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def health(self):
+        # polled by serving/router.py and tool/benchmark_threads.py; 503 until warmed up
+        status = self.health_status()
+        if not status['ready']:
+            cherrypy.response.status = 503
+        return status
 
-            outbound_logger.info('result: {}'.format(result))
-        if identifier in self.popped_locks:
-            self.popped_locks[identifier].release()
-        return str(result)
+    @cherrypy.expose
+    def reset(self, identifier):
+        self._require_ready()
+        return self.handle_reset(identifier, cherrypy.request.body.read())
 
 def main(args):
+    cpus = parse_cpus(args.cpus) if args.cpus is not None else None
+    if cpus is not None:
+        # before any TensorFlow thread pool is created
+        pin(cpus)
     config = tf.ConfigProto(gpu_options=tf.GPUOptions(visible_device_list=args.gpu, allow_growth=True))
+    if args.thread_policy is not None:
+        plan = ThreadPlan(args.thread_policy, cpus, args.cnn_replicas)
+        app_logger.info('thread plan: {}'.format(plan.as_dict()))
+        config.intra_op_parallelism_threads = plan.a3c_intra_threads
+        config.inter_op_parallelism_threads = plan.a3c_inter_threads
+        args.cnn_replicas = plan.cnn_replicas
+        args.cnn_threads = plan.cnn_threads
+        args.cnn_workers = plan.cnn_workers
+        args.decode_workers = plan.decode_workers
+        args.decode_threads = plan.decode_threads
+        args.policy_workers = plan.policy_workers
+        args.deferred_workers = plan.deferred_workers
+        args.session_concurrency = plan.session_concurrency
+        args.frontend_threads = plan.frontend_threads
     sess = tf.Session(config=config)
     cherrypy.config.update({'server.socket_host': args.host, 'server.socket_port': args.port, 'log.screen': False,
                             'log.access_file': CHERRYPY_ACCESS_LOG, 'log.error_file': CHERRYPY_ERROR_LOG})
@@ -233,9 +774,44 @@ def main(args):
     # server = wsgiserver.WSGIServer(app, host=args.host, port=args.port)
     # server.start()
 
+    root = Root(sess, args.logdir, args.workers,
+                args.visualize, sparse=args.sparse,
+                record_dir=args.record,
+                cnn_weights=args.cnn_weights,
+                cameras=args.cameras,
+                feature_cache_mb=args.feature_cache_mb,
+                cnn_replicas=args.cnn_replicas,
+                cnn_threads=args.cnn_threads,
+                feature_service=args.feature_service,
+                backbone=args.backbone,
+                decode_workers=args.decode_workers,
+                cnn_workers=args.cnn_workers,
+                policy_workers=args.policy_workers,
+                stage_queue_size=args.stage_queue_size,
+                decode_threads=args.decode_threads,
+                deferred_workers=args.deferred_workers,
+                max_workers=args.max_workers,
+                idle_timeout=args.idle_timeout,
+                admission_timeout=args.admission_timeout,
+                session_concurrency=args.session_concurrency,
+                warm_up=not args.no_warm_up)
+
+    if args.stream_port is not None:
+        # persistent length-prefixed msgpack connections next to the HTTP API
+        stream_server = StreamServer((args.host, args.stream_port), root)
+        stream_thread = Thread(target=stream_server.serve_forever, name='stream-server')
+        stream_thread.daemon = True
+        stream_thread.start()
+
+    if args.frontend == 'tornado':
+        # event loop with keep-alive and a bounded pool of request threads
+        from serving.frontend import serve
+        serve(root, args.host, args.port, threads=args.frontend_threads,
+              queue_size=args.frontend_queue_size, idle_timeout=args.keepalive_timeout)
+        return
+
     # wsgiref
-    app = cherrypy.tree.mount(Root(sess, args.logdir, args.workers,
-                                   args.visualize), '/')
+    app = cherrypy.tree.mount(root, '/')
     server = make_server(args.host, args.port, app, ThreadingWsgiServer)
     server.serve_forever()
 
@@ -245,8 +821,61 @@ if __name__ == '__main__':
     parser.add_argument('--port', default=8765, type=int, help='Server port number')
     parser.add_argument('--gpu', default='-1', type=str, help='Gpu id')
     parser.add_argument('--logdir', default='board', type=str, help='log directory for tensorboard')
-    parser.add_argument('--workers', default=4, type=int, help='the number of workers')
+    parser.add_argument('--workers', default=4, type=int, help='the number of workers built at startup')
+    parser.add_argument('--max-workers', default=None, type=int,
+                        help='workers are added on demand up to this number, defaults to --workers')
+    parser.add_argument('--idle-timeout', default=600, type=float,
+                        help='seconds after which the worker of a silent identifier is reclaimed, 0 disables')
+    parser.add_argument('--admission-timeout', default=10, type=float,
+                        help='seconds a new identifier waits for a free worker before 503 is returned')
     parser.add_argument('--visualize', action='store_true')
+    parser.add_argument('--sparse', action='store_true', help='feed pool5 features as sparse tensors')
+    parser.add_argument('--record', default=None, type=str, help='directory to record request payloads to')
+    parser.add_argument('--cameras', default=image_feature_count, type=int,
+                        help='number of image/depth pairs per observation')
+    parser.add_argument('--feature-cache-mb', default=64, type=int,
+                        help='memory budget of the camera feature cache, 0 disables it')
+    parser.add_argument('--cnn-replicas', default=1, type=int, help='number of AlexNet replicas')
+    parser.add_argument('--cnn-threads', default=0, type=int,
+                        help='intra-op threads per AlexNet replica, 0 uses the TensorFlow default')
+    parser.add_argument('--backbone', default='alexnet', choices=sorted(BACKBONES),
+                        help='visual trunk from tfalex/backbones.py; one without pretrained weights needs --cnn-weights')
+    parser.add_argument('--cnn-weights', default=None, type=str,
+                        help='backbone weights: an archive from tool/convert_weights.py, or a pickled .npy, '
+                             'which is read whole even if the layers past the outcome are skipped; defaults '
+                             'to the weights registered with the backbone, as an archive when one sits next to them')
+    parser.add_argument('--feature-service', default=None, type=str,
+                        help='URL of feature_server.py to use instead of a local AlexNet')
+    parser.add_argument('--frontend', default='wsgiref', choices=['wsgiref', 'tornado'],
+                        help='wsgiref: a thread per connection, tornado: event loop and bounded request threads')
+    parser.add_argument('--frontend-threads', default=32, type=int,
+                        help='requests processed concurrently by the tornado front end')
+    parser.add_argument('--frontend-queue-size', default=256, type=int,
+                        help='requests waiting for a front end thread before 503 is returned')
+    parser.add_argument('--keepalive-timeout', default=3600, type=float,
+                        help='seconds an idle keep-alive connection is kept open by the tornado front end')
+    parser.add_argument('--stream-port', default=None, type=int,
+                        help='also serve the length-prefixed msgpack stream protocol on this port')
+    parser.add_argument('--decode-workers', default=2, type=int, help='threads of the PNG decode stage')
+    parser.add_argument('--decode-threads', default=None, type=int,
+                        help='threads decoding the PNGs of an observation in parallel, defaults to the cores')
+    parser.add_argument('--cnn-workers', default=None, type=int,
+                        help='threads of the CNN stage, defaults to --cnn-replicas')
+    parser.add_argument('--policy-workers', default=None, type=int,
+                        help='threads of the policy stage, defaults to --workers')
+    parser.add_argument('--deferred-workers', default=None, type=int,
+                        help='threads running logging and training after the response, defaults to --workers; '
+                             '0 runs them before responding')
+    parser.add_argument('--session-concurrency', default=None, type=int,
+                        help='threads running the agent graph at once, defaults to the number of cores')
+    parser.add_argument('--thread-policy', default=None, type=str,
+                        help='split the cores between CNN, A3C and request threads: {} or shares "cnn:a3c:io"; '
+                             'overrides the CNN, stage, deferred, session and front end thread options'.format(', '.join(sorted(POLICIES))))
+    parser.add_argument('--cpus', default=None, type=str, help='pin the process to these cores, e.g. 0-3,8')
+    parser.add_argument('--no-warm-up', action='store_true',
+                        help='accept requests right away instead of running every graph once at startup')
+    parser.add_argument('--stage-queue-size', default=16, type=int,
+                        help='bound of the queue in front of every pipeline stage')
     args = parser.parse_args()
 
     main(args)
@@ -0,0 +1,167 @@
+import logging
+import time
+from threading import Condition, Lock, Thread
+
+from config.log import APP_KEY
+
+app_logger = logging.getLogger(APP_KEY)
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class AgentPool(object):
+    '''Assigns worker agents to environment identifiers.
+
+    Agents are built lazily by build(index) up to max_agents. An identifier
+    that sends nothing for idle_timeout seconds gives its agent back once
+    reclaim(identifier, agent) ran under the identifier's lock. A new
+    identifier waits up to admission_timeout seconds for an agent to become
+    free before PoolExhausted is raised.
+    '''
+
+    def __init__(self, build, reclaim, initial=1, max_agents=None, idle_timeout=None, admission_timeout=10.0):
+        self.build = build
+        self.reclaim = reclaim
+        self.max_agents = max(max_agents or initial, initial)
+        self.idle_timeout = idle_timeout
+        self.admission_timeout = admission_timeout
+        self.free = []
+        self.agents = {}        # identifier -> agent
+        self.locks = {}         # identifier -> Lock serializing its requests
+        self.last_seen = {}
+        self.size = 0
+        self.reclaimed = 0
+        self.rejected = 0
+        self.condition = Condition()
+        for index in range(initial):
+            self.free.append(self.build(index))
+            self.size += 1
+
+        if idle_timeout:
+            reaper = Thread(target=self._reap, name='agent-reaper')
+            reaper.daemon = True
+            reaper.start()
+
+    def acquire(self, identifier):
+        '''Returns (agent, new) for the identifier, assigning an agent if it has none.'''
+        deadline = time.time() + self.admission_timeout
+        with self.condition:
+            while True:
+                if identifier in self.agents:
+                    self.last_seen[identifier] = time.time()
+                    return self.agents[identifier], False
+                if len(self.free) > 0:
+                    agent = self.free.pop(0)
+                    break
+                if self.size < self.max_agents:
+                    # reserve the index and build outside the lock
+                    index = self.size
+                    self.size += 1
+                    agent = None
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.rejected += 1
+                    raise PoolExhausted('no free agent for {} within {}s'.format(identifier,
+                                                                               self.admission_timeout))
+                self.condition.wait(remaining)
+
+        if agent is None:
+            try:
+                agent = self.build(index)
+            except Exception:
+                with self.condition:
+                    self.size -= 1
+                    self.condition.notify()
+                raise
+
+        with self.condition:
+            if identifier in self.agents:
+                # a concurrent create of the same identifier won
+                self.free.append(agent)
+                self.condition.notify()
+                return self.agents[identifier], False
+            self.agents[identifier] = agent
+            self.locks[identifier] = Lock()
+            self.last_seen[identifier] = time.time()
+        return agent, True
+
+    def get(self, identifier):
+        with self.condition:
+            if identifier not in self.agents:
+                return None
+            self.last_seen[identifier] = time.time()
+            return self.agents[identifier]
+
+    def hold(self, identifier, create=False):
+        '''Takes the identifier's lock; returns (agent, new, lock) with the lock held.
+        create: assign an agent to an unknown identifier, otherwise (None, False, None) is returned for it
+        The reaper may reclaim the identifier while the lock is awaited; its
+        agent then belongs to the free list, so the assignment is looked up again.
+        '''
+        while True:
+            new = False
+            if create:
+                agent, new = self.acquire(identifier)
+            with self.condition:
+                if not create:
+                    agent = self.agents.get(identifier)
+                lock = self.locks.get(identifier)
+            if agent is None:
+                return None, False, None
+            if lock is None:
+                continue
+            lock.acquire()
+            with self.condition:
+                if self.locks.get(identifier) is lock and self.agents.get(identifier) is agent:
+                    self.last_seen[identifier] = time.time()
+                    return agent, new, lock
+            lock.release()
+
+    def _reap(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 4.0, 1.0))
+            now = time.time()
+            with self.condition:
+                idle = [identifier for identifier, seen in self.last_seen.items()
+                        if now - seen > self.idle_timeout]
+            for identifier in idle:
+                self._reclaim(identifier)
+
+    def _reclaim(self, identifier):
+        with self.condition:
+            lock = self.locks.get(identifier)
+        if lock is None:
+            return
+        with lock:
+            with self.condition:
+                if time.time() - self.last_seen.get(identifier, 0) <= self.idle_timeout:
+                    return
+                agent = self.agents.get(identifier)
+            if agent is None:
+                return
+            try:
+                self.reclaim(identifier, agent)
+            except Exception:
+                app_logger.exception('reclaiming the agent of {} failed'.format(identifier))
+            with self.condition:
+                del self.agents[identifier]
+                del self.locks[identifier]
+                del self.last_seen[identifier]
+                self.free.append(agent)
+                self.reclaimed += 1
+                self.condition.notify()
+        app_logger.info('reclaimed the agent of idle identifier {}'.format(identifier))
+
+    def stats(self):
+        with self.condition:
+            return {
+                'agents': self.size,
+                'max_agents': self.max_agents,
+                'assigned': len(self.agents),
+                'free': len(self.free),
+                'reclaimed': self.reclaimed,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,73 @@
+import multiprocessing
+
+import numpy as np
+from PIL import Image
+
+from pipeline import WorkerPool
+
+try:
+    # Python 2: a read-only cStringIO reads the str in place, io.BytesIO would copy it
+    from cStringIO import StringIO as reader
+except ImportError:
+    # Python 3: BytesIO shares an immutable bytes object until it is written to
+    from io import BytesIO as reader
+
+
+def open_png(data):
+    # msgpack hands out immutable bytes; the PNG is read from them without a copy
+    return Image.open(reader(data))
+
+
+class DecodeService(object):
+    '''Decodes the camera and depth PNGs of an observation in parallel.
+
+    Headers are parsed in the calling thread to size one uint8 block per
+    observation; every PNG is then decoded by the pool and its pixels are
+    copied into its slot by way of tobytes(). Pillow keeps RGB pixels padded
+    to four bytes, so it cannot decode into the slot itself.
+    Pillow releases the GIL while inflating, so threads scale with the cores.
+    workers: None uses one thread per core, 0 decodes in the calling thread
+    '''
+
+    def __init__(self, workers=None, depth_image_dim=32*32):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.depth_image_dim = depth_image_dim
+        self.pool = WorkerPool(workers, name='decode')
+
+    def decode(self, images, depths):
+        '''Returns the camera images as (h, w, 3) arrays and the depth images as flat arrays.
+        images: encoded camera PNGs, None entries are skipped and returned as None
+        depths: encoded depth PNGs
+        '''
+        opened = [open_png(data) if data is not None else None for data in images]
+        sizes = set(image.size for image in opened if image is not None)
+        if len(sizes) == 1:
+            width, height = sizes.pop()
+            block = np.empty((len(opened), height, width, 3), dtype=np.uint8)
+            slots = list(block)
+        else:
+            slots = [np.empty((image.size[1], image.size[0], 3), dtype=np.uint8) if image is not None else None
+                     for image in opened]
+        depth_block = np.empty((len(depths), self.depth_image_dim), dtype=np.uint8)
+
+        futures = []
+        for image, slot in zip(opened, slots):
+            if image is not None:
+                futures.append(self.pool.submit(self._decode_image, image, slot))
+        for data, slot in zip(depths, depth_block):
+            futures.append(self.pool.submit(self._decode_depth, data, slot))
+        for future in futures:
+            future.result()
+
+        decoded = [slot if image is not None else None for image, slot in zip(opened, slots)]
+        return decoded, list(depth_block)
+
+    def _decode_image(self, image, out):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        # the unpadded pixels of Pillow's image memory
+        out[...] = np.frombuffer(image.tobytes(), dtype=np.uint8).reshape(out.shape)
+
+    def _decode_depth(self, data, out):
+        out[:] = np.asarray(open_png(data).convert('L')).reshape(self.depth_image_dim)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Event-loop HTTP front end for server.Root.
+
+A single tornado IOLoop accepts connections, keeps HTTP/1.1 connections
+alive and parses requests; the handle_* calls of Root run on a bounded
+WorkerPool. When its queue is full the request is answered with 503 right
+away instead of piling up threads.
+"""
+import json
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.web
+from tornado import gen
+from tornado.concurrent import Future as TornadoFuture
+
+from pipeline import WorkerPool
+from agent_pool import PoolExhausted
+from protocol import response_format
+
+
+def wrap_future(future, io_loop):
+    # resolve on the IOLoop thread, pipeline futures complete on worker threads
+    wrapped = TornadoFuture()
+
+    def resolve(done):
+        error = done.error()
+        if error is not None:
+            io_loop.add_callback(wrapped.set_exception, error)
+        else:
+            io_loop.add_callback(wrapped.set_result, done.result())
+    future.add_done_callback(resolve)
+    return wrapped
+
+
+class LISHandler(tornado.web.RequestHandler):
+    def initialize(self, root, executor):
+        self.root = root
+        self.executor = executor
+
+    def prepare(self):
+        if not self.root.ready.is_set():
+            raise tornado.web.HTTPError(503, 'warming up')
+
+    def _call(self, method, *args):
+        future = self.executor.offer(method, *args)
+        if future is None:
+            raise tornado.web.HTTPError(503, 'server busy')
+        return wrap_future(future, tornado.ioloop.IOLoop.current())
+
+    @gen.coroutine
+    def post(self, method, identifier):
+        body = self.request.body
+        payload_format = self.request.headers.get('X-LIS-Payload', 'png').lower()
+        if method in ('create', 'step'):
+            try:
+                self.root.check_payload_format(payload_format)
+            except ValueError as e:
+                raise tornado.web.HTTPError(415, str(e))
+            try:
+                negotiated = response_format(self.request.headers.get('Accept'), self.get_argument('format', None))
+            except ValueError as e:
+                raise tornado.web.HTTPError(406, str(e))
+            if negotiated == 'msgpack':
+                self.set_header('Content-Type', 'application/x-msgpack')
+            args = [identifier, body, payload_format, negotiated]
+            if method == 'create':
+                try:
+                    frame_skip = int(self.get_argument('frame_skip', 1))
+                except ValueError:
+                    frame_skip = 0
+                if frame_skip < 1:
+                    raise tornado.web.HTTPError(400, 'frame_skip must be a positive integer')
+                args.append(frame_skip)
+            try:
+                result = yield self._call(getattr(self.root, 'handle_' + method), *args)
+            except PoolExhausted as e:
+                raise tornado.web.HTTPError(503, str(e))
+        elif method == 'reset':
+            result = yield self._call(self.root.handle_reset, identifier, body)
+        else:
+            try:
+                result = yield self._call(self.root.handle_flush, identifier)
+            except PoolExhausted as e:
+                raise tornado.web.HTTPError(503, str(e))
+        self.write(result if result is not None else '')
+
+    get = post
+
+
+class BatchHandler(LISHandler):
+    @gen.coroutine
+    def post(self):
+        payload_format = self.request.headers.get('X-LIS-Payload', 'png').lower()
+        try:
+            self.root.check_payload_format(payload_format)
+        except ValueError as e:
+            raise tornado.web.HTTPError(415, str(e))
+        try:
+            result = yield self._call(self.root.handle_step_batch, self.request.body, payload_format)
+        except (ValueError, KeyError) as e:
+            raise tornado.web.HTTPError(400, str(e))
+        self.set_header('Content-Type', 'application/x-msgpack')
+        self.write(result)
+
+    get = post
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    def initialize(self, stats):
+        self.stats = stats
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(self.stats()))
+
+
+class HealthHandler(StatsHandler):
+    def get(self):
+        status = self.stats()
+        if not status['ready']:
+            self.set_status(503)
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(status))
+
+
+def make_app(root, executor):
+    return tornado.web.Application([
+        (r'/(create|step|reset|flush)/([^/]+)', LISHandler, dict(root=root, executor=executor)),
+        (r'/step_batch', BatchHandler, dict(root=root, executor=executor)),
+        (r'/metrics', StatsHandler, dict(stats=lambda: dict(root.stats(), frontend={
+            'threads': len(executor.workers), 'pending': executor.pending()}))),
+        (r'/feature_cache_stats', StatsHandler, dict(stats=root.feature_cache.stats)),
+        (r'/health', HealthHandler, dict(stats=root.health_status)),
+    ])
+
+
+def serve(root, host, port, threads=32, queue_size=256, idle_timeout=3600):
+    '''Serves root until interrupted.
+    threads: concurrent handle_* calls
+    queue_size: requests waiting for a thread before 503 is returned
+    idle_timeout: seconds a keep-alive connection may stay idle
+    '''
+    executor = WorkerPool(threads, name='frontend', queue_size=queue_size)
+    server = tornado.httpserver.HTTPServer(make_app(root, executor),
+                                          idle_connection_timeout=idle_timeout,
+                                          max_body_size=64 * 1024 * 1024)
+    server.listen(port, address=host)
+    tornado.ioloop.IOLoop.current().start()
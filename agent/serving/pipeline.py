@@ -0,0 +1,203 @@
+import Queue
+import time
+from threading import Event, Lock, Thread
+
+
+class Future(object):
+    '''Result of a job handed to a worker thread.'''
+
+    def __init__(self):
+        self._done = Event()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+        self._lock = Lock()
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_error(self, error):
+        self._error = error
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def error(self):
+        return self._error
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('timed out waiting for the job')
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _Job(object):
+    def __init__(self, value, future, last=None):
+        self.value = value
+        self.future = future
+        # name of the stage whose output resolves the future, None runs to the end
+        self.last = last
+        self.enqueued = time.time()
+
+
+class Stage(object):
+    '''A bounded queue served by its own pool of worker threads.
+
+    fn maps the job value to the value handed to the next stage. A full queue
+    blocks the submitter, so a slow stage pushes back on the stage before it.
+    '''
+
+    def __init__(self, name, fn, workers=1, queue_size=16):
+        self.name = name
+        self.fn = fn
+        self.next = None
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.lock = Lock()
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0
+        self.service_time = 0.0
+        self.wait_time = 0.0
+        self.workers = []
+        for i in range(workers):
+            worker = Thread(target=self._run, name='{}-{}'.format(name, i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def put(self, job):
+        job.enqueued = time.time()
+        self.queue.put(job)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            start = time.time()
+            with self.lock:
+                self.busy += 1
+                self.wait_time += start - job.enqueued
+            try:
+                value = self.fn(job.value)
+            except Exception as e:
+                value = None
+                job.future.set_error(e)
+            elapsed = time.time() - start
+            with self.lock:
+                self.busy -= 1
+                self.service_time += elapsed
+                if job.future.error() is None:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+            if job.future.done():
+                continue
+            if self.next is None or job.last == self.name:
+                job.future.set_result(value)
+            else:
+                job.value = value
+                self.next.put(job)
+
+    def stats(self):
+        with self.lock:
+            count = self.processed + self.failed
+            return {
+                'workers': len(self.workers),
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'busy': self.busy,
+                'processed': self.processed,
+                'failed': self.failed,
+                'mean_service_ms': 1000.0 * self.service_time / count if count > 0 else 0.0,
+                'mean_wait_ms': 1000.0 * self.wait_time / count if count > 0 else 0.0,
+            }
+
+
+class Pipeline(object):
+    '''Stages connected in order; a job flows from the first stage to the last.
+    first/last: names of the stages a job enters and leaves at, defaults to all of them
+    '''
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.by_name = dict((stage.name, stage) for stage in stages)
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next = next_stage
+
+    def submit(self, value, first=None, last=None):
+        future = Future()
+        stage = self.by_name[first] if first is not None else self.stages[0]
+        stage.put(_Job(value, future, last))
+        return future
+
+    def run(self, value, timeout=None, first=None, last=None):
+        return self.submit(value, first, last).result(timeout)
+
+    def stats(self):
+        return dict((stage.name, stage.stats()) for stage in self.stages)
+
+
+class WorkerPool(object):
+    '''A fixed set of threads running submitted calls; workers=0 runs them inline.'''
+
+    def __init__(self, workers, name='worker', queue_size=0):
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.workers = []
+        for i in range(workers):
+            worker = Thread(target=self._run, name='{}-{}'.format(name, i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, fn, *args):
+        future = Future()
+        if len(self.workers) == 0:
+            self._call(future, fn, args)
+        else:
+            self.queue.put((future, fn, args))
+        return future
+
+    def offer(self, fn, *args):
+        '''Like submit, but returns None instead of waiting when the queue is full.'''
+        future = Future()
+        try:
+            self.queue.put_nowait((future, fn, args))
+        except Queue.Full:
+            return None
+        return future
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def map(self, fn, items):
+        return [future.result() for future in [self.submit(fn, item) for item in items]]
+
+    def _call(self, future, fn, args):
+        try:
+            result = fn(*args)
+        except Exception as e:
+            future.set_error(e)
+        else:
+            future.set_result(result)
+
+    def _run(self):
+        while True:
+            future, fn, args = self.queue.get()
+            self._call(future, fn, args)
@@ -0,0 +1,15 @@
+# X-LIS-Payload header values; png is what the Unity LISClient sends
+PAYLOAD_FORMATS = ('png', 'raw')
+# text is "action/stage", msgpack adds the value estimate and the decode/cnn/policy time of the frame
+RESPONSE_FORMATS = ('text', 'msgpack')
+
+
+def response_format(accept=None, requested=None):
+    '''Picks the create/step response format from the format parameter or the Accept header.'''
+    if requested is not None:
+        if requested not in RESPONSE_FORMATS:
+            raise ValueError('unknown response format: {}'.format(requested))
+        return requested
+    if accept is not None and 'application/x-msgpack' in accept:
+        return 'msgpack'
+    return 'text'
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Local identifier-affinity router in front of several server.py backends.
+
+/create/<id>, /step/<id>, /reset/<id> and /flush/<id> always go to the
+backend an identifier was first assigned to, since its agent lives there.
+New identifiers are hashed over the backends that pass their /health
+check; a /create for an identifier whose backend is down assigns it anew.
+/step_batch is split per backend and the actions are merged back in order.
+"""
+import BaseHTTPServer
+import errno
+import hashlib
+import httplib
+import json
+import logging
+import socket
+import SocketServer
+import time
+import urlparse
+from threading import Lock, Thread, local
+
+import msgpack
+
+from config.log import APP_KEY
+
+app_logger = logging.getLogger(APP_KEY)
+
+FORWARDED_HEADERS = ('Content-Type', 'Accept', 'X-LIS-Payload')
+
+
+class Backend(object):
+    def __init__(self, host, port, timeout=120):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.healthy = False
+        self.local = local()
+
+    def __str__(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    def _connection(self):
+        # one keep-alive connection per router thread; returns (connection, reused)
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            return connection, True
+        connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self.local.connection = connection
+        return connection, False
+
+    def _drop(self, connection):
+        connection.close()
+        self.local.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        # create/step/reset are not idempotent: a request is sent again only when a reused
+        # keep-alive connection turns out to be closed by the backend, i.e. before it read anything
+        while True:
+            connection, reused = self._connection()
+            try:
+                connection.request(method, path, body, headers or {})
+            except socket.error as e:
+                self._drop(connection)
+                if reused and e.errno in (errno.ECONNRESET, errno.EPIPE):
+                    continue
+                raise
+            try:
+                response = connection.getresponse()
+                return response.status, response.getheader('Content-Type'), response.read()
+            except httplib.BadStatusLine:
+                # an empty status line: the idle connection was closed under the request
+                self._drop(connection)
+                if reused:
+                    continue
+                raise
+            except (httplib.HTTPException, IOError):
+                self._drop(connection)
+                raise
+
+    def check(self):
+        try:
+            status, _, _ = self.request('GET', '/health')
+            self.healthy = status == 200
+        except (httplib.HTTPException, IOError):
+            self.healthy = False
+        return self.healthy
+
+
+class Router(object):
+    def __init__(self, backends, health_interval=2.0):
+        self.backends = backends
+        self.affinity = {}  # identifier -> Backend
+        self.lock = Lock()
+        self.health_interval = health_interval
+        for backend in backends:
+            backend.check()
+        checker = Thread(target=self._check_health, name='router-health')
+        checker.daemon = True
+        checker.start()
+
+    def _check_health(self):
+        while True:
+            time.sleep(self.health_interval)
+            for backend in self.backends:
+                was_healthy = backend.healthy
+                if backend.check() != was_healthy:
+                    app_logger.info('backend {} is {}'.format(backend, 'up' if backend.healthy else 'down'))
+
+    def backend_for(self, identifier, create=False):
+        with self.lock:
+            backend = self.affinity.get(identifier)
+            if backend is not None and (backend.healthy or not create):
+                return backend
+            healthy = [b for b in self.backends if b.healthy]
+            if len(healthy) == 0:
+                return None
+            # new identifiers are spread over the healthy backends only
+            backend = healthy[int(hashlib.md5(identifier).hexdigest(), 16) % len(healthy)]
+            self.affinity[identifier] = backend
+            return backend
+
+    def step_batch(self, body, headers):
+        messages = msgpack.unpackb(body)
+        groups = {}
+        for position, message in enumerate(messages):
+            backend = self.backend_for(message['identifier'])
+            if backend is None:
+                raise IOError('no healthy backend')
+            groups.setdefault(backend, []).append((position, message))
+
+        actions = [None] * len(messages)
+        stages = []
+        errors = []
+
+        def forward(backend, records):
+            try:
+                status, _, data = backend.request('POST', '/step_batch',
+                                                  msgpack.packb([message for _, message in records]), headers)
+                if status != 200:
+                    raise IOError('{} answered {}'.format(backend, status))
+                response = msgpack.unpackb(data)
+                for (position, _), action in zip(records, response['actions']):
+                    actions[position] = action
+                stages.append(response['stage'])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=forward, args=item) for item in groups.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(errors) > 0:
+            raise errors[0]
+        return msgpack.packb({'actions': actions, 'stage': max(stages) if len(stages) > 0 else -1})
+
+    def stats(self):
+        with self.lock:
+            counts = {}
+            for backend in self.affinity.values():
+                counts[str(backend)] = counts.get(str(backend), 0) + 1
+        return dict((str(backend), {'healthy': backend.healthy, 'identifiers': counts.get(str(backend), 0)})
+                    for backend in self.backends)
+
+
+class RouterHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, content_type, data):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type or 'text/plain')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self):
+        router = self.server.router
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else None
+        headers = dict((name, self.headers[name]) for name in FORWARDED_HEADERS if name in self.headers)
+        parts = urlparse.urlparse(self.path).path.strip('/').split('/')
+        try:
+            if parts == ['health']:
+                healthy = any(backend.healthy for backend in router.backends)
+                self._reply(200 if healthy else 503, 'application/json', json.dumps(router.stats()))
+            elif parts == ['step_batch']:
+                self._reply(200, 'application/x-msgpack', router.step_batch(body, headers))
+            elif len(parts) == 2 and parts[0] in ('create', 'step', 'reset', 'flush'):
+                backend = router.backend_for(parts[1], create=parts[0] == 'create')
+                if backend is None:
+                    self._reply(503, None, 'no healthy backend')
+                    return
+                status, content_type, data = backend.request(self.command, self.path, body, headers)
+                self._reply(status, content_type, data)
+            else:
+                self._reply(404, None, 'not found')
+        except (KeyError, ValueError) as e:
+            self._reply(400, None, str(e))
+        except (httplib.HTTPException, IOError) as e:
+            self._reply(502, None, str(e))
+
+    do_GET = _route
+    do_POST = _route
+
+
+class RouterServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, router):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RouterHandler)
+        self.router = router
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Length-prefixed msgpack protocol over a persistent TCP connection.
+
+Every frame is a 4-byte big-endian length followed by a msgpack map.
+Requests are {'type': 'create'|'step'|'reset'|'flush'|'step_batch',
+'identifier': id, 'body': the msgpack payload of the HTTP API,
+'payload_format': 'png'|'raw', 'response_format': 'text'|'msgpack'};
+create also takes 'frame_skip'. Each is answered in order with
+{'result': response body} or {'error': message}. Frames of one
+connection are handled one after another, so a client may send several
+before reading.
+"""
+import socket
+import struct
+import SocketServer
+
+import msgpack
+
+HEADER = struct.Struct('>I')
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def read_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frame(sock):
+    header = read_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise ValueError('frame of {} bytes exceeds the limit'.format(size))
+    return read_exactly(sock, size)
+
+
+def write_frame(sock, data):
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+class StreamHandler(SocketServer.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        root = self.server.root
+        while True:
+            try:
+                frame = read_frame(self.request)
+            except (ValueError, socket.error):
+                return
+            if frame is None:
+                return
+            try:
+                # a malformed frame is answered with an error; the connection carries other agents
+                message = msgpack.unpackb(frame)
+                response = {'result': self.dispatch(root, message)}
+            except Exception as e:
+                response = {'error': '{}: {}'.format(type(e).__name__, e)}
+            write_frame(self.request, msgpack.packb(response))
+
+    def dispatch(self, root, message):
+        kind = message['type']
+        if not root.ready.is_set():
+            raise RuntimeError('warming up')
+        payload_format = message.get('payload_format', 'png')
+        response_format = message.get('response_format', 'text')
+        if kind == 'step':
+            return root.handle_step(message['identifier'], message['body'], payload_format, response_format)
+        elif kind == 'create':
+            return root.handle_create(message['identifier'], message['body'], payload_format, response_format,
+                                      message.get('frame_skip', 1))
+        elif kind == 'reset':
+            return root.handle_reset(message['identifier'], message['body'])
+        elif kind == 'flush':
+            return root.handle_flush(message['identifier'])
+        elif kind == 'step_batch':
+            return root.handle_step_batch(message['body'], payload_format)
+        raise ValueError('unknown message type: {}'.format(kind))
+
+
+class StreamServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    '''One thread per connection; a connection carries the frames of one or many agents.'''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, root):
+        SocketServer.TCPServer.__init__(self, address, StreamHandler)
+        self.root = root
+
+
+class StreamClient(object):
+    '''Python stand-in for the Unity client speaking the stream protocol.'''
+
+    def __init__(self, host, port, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, kind, identifier=None, body=None, payload_format='png', response_format='text', frame_skip=1):
+        '''frame_skip: read by create only'''
+        write_frame(self.sock, msgpack.packb({'type': kind, 'identifier': identifier, 'body': body,
+                                              'payload_format': payload_format,
+                                              'response_format': response_format,
+                                              'frame_skip': frame_skip}))
+
+    def receive(self):
+        frame = read_frame(self.sock)
+        if frame is None:
+            raise socket.error('connection closed by the server')
+        response = msgpack.unpackb(frame)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def call(self, kind, identifier=None, body=None, payload_format='png', response_format='text', frame_skip=1):
+        self.send(kind, identifier, body, payload_format, response_format, frame_skip)
+        return self.receive()
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import subprocess
+
+# shares of the cores for the CNN sessions, the A3C session and the request threads (decode, executors)
+POLICIES = {
+    'balanced': (2, 1, 1),
+    'cnn': (3, 1, 1),
+    'a3c': (1, 2, 1),
+    'io': (1, 1, 2),
+}
+
+
+def parse_cpus(text):
+    '''"0-3,6" -> [0, 1, 2, 3, 6]'''
+    cpus = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+def format_cpus(cpus):
+    return ','.join(str(cpu) for cpu in cpus)
+
+
+def available_cpus():
+    '''The cores this process may run on, respecting an affinity set by taskset or a launcher.'''
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    # Python 2: the kernel reports the affinity list of the process
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('Cpus_allowed_list:'):
+                    return parse_cpus(line.split(':', 1)[1].strip())
+    except IOError:
+        pass
+    return list(range(multiprocessing.cpu_count()))
+
+
+def pin(cpus, pid=0):
+    '''Restricts the process (0: this one) and its future threads to the cpus.'''
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(pid, cpus)
+        return
+    # Python 2 has no sched_setaffinity
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(['taskset', '-a', '-p', '-c', format_cpus(cpus), str(pid or os.getpid())],
+                              stdout=devnull)
+
+
+def split_cpus(cpus, parts):
+    '''Splits cpus into parts contiguous core sets, e.g. one per backend process.'''
+    size, extra = divmod(len(cpus), parts)
+    sets = []
+    start = 0
+    for i in range(parts):
+        stop = start + size + (1 if i < extra else 0)
+        sets.append(cpus[start:stop] or cpus[i % len(cpus):i % len(cpus) + 1])
+        start = stop
+    return sets
+
+
+class ThreadPlan(object):
+    '''Thread counts for one server process so that its pools add up to its cores.
+
+    TensorFlow sizes the intra-op pool of every session to all cores; with an
+    AlexNet session per replica, the A3C session and a thread per request the
+    CPU is oversubscribed several times. The plan divides the cores by the
+    policy shares and sizes each pool to its part. Every part gets at least
+    one core, so with fewer than three cores the parts share them.
+    policy: a name from POLICIES or shares as "cnn:a3c:io", e.g. "2:1:1"
+    '''
+
+    def __init__(self, policy='balanced', cpus=None, cnn_replicas=1):
+        self.policy = policy
+        self.cpus = cpus if cpus is not None else available_cpus()
+        shares = POLICIES[policy] if policy in POLICIES else tuple(float(share) for share in policy.split(':'))
+        if len(shares) != 3 or min(shares) <= 0:
+            raise ValueError('a thread policy needs three positive shares, got {}'.format(policy))
+        total = float(sum(shares))
+        count = len(self.cpus)
+
+        cnn = max(1, int(round(count * shares[0] / total)))
+        a3c = max(1, int(round(count * shares[1] / total)))
+        # rounding and the floor of one core may overshoot; take the excess from the larger part
+        while cnn + a3c + 1 > count and max(cnn, a3c) > 1:
+            if cnn >= a3c:
+                cnn -= 1
+            else:
+                a3c -= 1
+        io = max(1, count - cnn - a3c)
+
+        self.cnn_replicas = max(1, min(cnn_replicas, cnn))
+        # intra-op threads of every AlexNet replica
+        self.cnn_threads = max(1, cnn // self.cnn_replicas)
+        self.a3c_intra_threads = a3c
+        self.a3c_inter_threads = 1 if a3c < 4 else 2
+        # concurrent sess.run of the A3C graph; more would only queue on its pool
+        self.session_concurrency = max(1, a3c)
+        # frames are decoded in parallel by the decode stage, each in its stage thread
+        self.decode_workers = io
+        self.decode_threads = 0
+        self.cnn_workers = self.cnn_replicas
+        self.policy_workers = self.session_concurrency
+        # training runs on the A3C graph as well
+        self.deferred_workers = self.session_concurrency
+        # requests in flight; they mostly wait on the stages, twice the cores keeps every stage fed
+        self.frontend_threads = 2 * count
+
+    def as_dict(self):
+        return {
+            'policy': self.policy,
+            'cpus': format_cpus(self.cpus),
+            'cnn_replicas': self.cnn_replicas,
+            'cnn_threads': self.cnn_threads,
+            'a3c_intra_threads': self.a3c_intra_threads,
+            'a3c_inter_threads': self.a3c_inter_threads,
+            'session_concurrency': self.session_concurrency,
+            'decode_workers': self.decode_workers,
+            'decode_threads': self.decode_threads,
+            'cnn_workers': self.cnn_workers,
+            'policy_workers': self.policy_workers,
+            'deferred_workers': self.deferred_workers,
+            'frontend_threads': self.frontend_threads,
+        }
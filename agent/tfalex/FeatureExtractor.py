@@ -1,33 +1,90 @@
 import tensorflow as tf
-from mynet import AlexNet as MyNet
+from backbones import get_backbone
+from quantize import with_mode
 import numpy as np
+from ml.sparse import SparseFeature
 
 DEFAULT_MEAN_IMAGE = './tfalex/ilsvrc_2012_mean.npy'
 
 
-class FeatureExtractor():
-    def __init__(self, sess_name, sess_config, in_size=227, out_dim=9216):
+class BaseFeatureExtractor(object):
+    # subclasses set out_dim, sparse and feature_cache and implement image_features
 
-        self.batchsize = 1
-        self.out_dim = out_dim
-        self.in_size = in_size
-        self.outcome = 'pool5'
+    def image_features(self, camera_images):
+        raise NotImplementedError('Must be implemented by the subclass.')
 
-        print('Building AlexNet')
-        self.sess = tf.Session(config=sess_config)
-
-        # TODO: take care of shapes (Batch-Size, W, H, Channel)
-        self.x = tf.placeholder(tf.float32, [1, self.in_size, self.in_size, 3])
-        # self.y = tf.placeholder(tf.float32, [None, self.])
-        self.net = self._build_network()
-        self.out = self.net.layers['pool5']
+    def feature(self, observation, image_feature_count=None):
+        # called by module.py VVC component
+        return self.features([observation], image_feature_count)[0]
+
+    def features(self, observations, image_feature_count=None):
+        # layout of each: features of every camera, then every depth image
+        # the cameras of all observations missing from the cache share one image_features call
+        outputs = []
+        pending = []
+        for observation in observations:
+            count = image_feature_count
+            if count is None:
+                count = len(observation["image"])
+            depth = observation["depth"][:count]
+
+            image_dim = count * self.out_dim
+            feature = np.empty(image_dim + sum(len(d) for d in depth), dtype=np.float32)
+            image_feature = feature[:image_dim].reshape(count, self.out_dim)
+
+            # features already found in the cache by server.unpack are not recomputed
+            cached = observation.get("image_features", [None] * count)
+            keys = observation.get("image_keys")
+            for i in range(count):
+                if cached[i] is not None:
+                    image_feature[i] = cached[i]
+                else:
+                    pending.append((observation["image"][i], image_feature, i,
+                                    keys[i] if keys is not None else None))
+
+            offset = image_dim
+            for d in depth:
+                feature[offset:offset + len(d)] = d
+                offset += len(d)
+            outputs.append(feature)
+
+        if len(pending) > 0:
+            computed = self.image_features([image for image, _, _, _ in pending])
+            for (_, image_feature, i, key), value in zip(pending, computed):
+                image_feature[i] = value
+                if self.feature_cache is not None and key is not None:
+                    self.feature_cache.put(key, image_feature[i].copy())
+
+        if self.sparse:
+            return [SparseFeature.from_dense(feature) for feature in outputs]
+        return outputs
+
+
+class FeatureExtractor(BaseFeatureExtractor):
+    def __init__(self, sess_name, sess_config, in_size=227, sparse=False, weights=None, feature_cache=None,
+                 mode='float', backbone='alexnet', outcome=None, require_weights=True):
 
-        # Initialize AlexNet
-        init = tf.global_variables_initializer()
-        self.sess.run(init)
-        print('Loading Weights...')
-        self.net.load('./tfalex/mynet.npy', self.sess)
-        print('Done!')
+        self.batchsize = 1
+        # size of the camera images; the backbone may run at a different resolution
+        self.in_size = in_size
+        # network, input resolution and output layer from tfalex.backbones
+        self.backbone = get_backbone(backbone)
+        # only the layers up to outcome are built and loaded
+        self.outcome = outcome if outcome is not None else self.backbone.outcome
+        # pool5 is post-ReLU and mostly zeros; hand out SparseFeature instead of dense vectors
+        self.sparse = sparse
+        # tfalex.cache.FeatureCache filled with the features of observations carrying image_keys
+        self.feature_cache = feature_cache
+        # 'float'; 'calibrate' and 'int8' are used by tool/quantize_alexnet.py only
+        self.mode = mode
+        if weights is None:
+            weights = self.backbone.weights
+        if weights is None and require_weights:
+            # features of random weights would reach the policy without any sign of it
+            raise ValueError('backbone {} has no pretrained weights, pass them explicitly'.format(
+                self.backbone.name))
+        if mode != 'float' and not self.backbone.quantizable:
+            raise ValueError('{} mode does not cover the layers of backbone {}'.format(mode, self.backbone.name))
 
         # load mean image, mean.shape: (256, 256, 3)
         mean_image = np.load(DEFAULT_MEAN_IMAGE).transpose(1, 2, 0)
@@ -36,50 +93,51 @@ class FeatureExtractor():
         cropwidth = 256 - self.in_size
         start = cropwidth // 2
         stop = start + self.in_size
-        self.mean_image = mean_image[start:stop, start:stop, :].copy()
+        self.mean_image = mean_image[start:stop, start:stop, :].astype(np.float32)
+
+        print('Building {}'.format(self.backbone.name))
+        # the network lives in its own graph so its session does not carry the A3C variables
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            # raw uint8 HWC pixels; the cast, mean subtraction and output scaling run in the graph
+            self.x = tf.placeholder(tf.uint8, [None, self.in_size, self.in_size, 3])
+            # self.y = tf.placeholder(tf.float32, [None, self.])
+            self.net = self._build_network(self._preprocess(self.x))
+            self.out = self.net.layers[self.outcome] * 255.0
+        # the feature dimension follows from the backbone, e.g. 256 * 6 * 6 for AlexNet pool5
+        self.out_dim = int(np.prod(self.out.get_shape().as_list()[1:]))
+        self.sess = tf.Session(graph=self.graph, config=sess_config)
+
+        # Initialize the network, with the pretrained weights if there are any
+        print('Loading Weights...')
+        self.net.load(weights, self.sess)
+        self.graph.finalize()
+        print('Done!')
 
-    def _build_network(self):
-        with tf.name_scope('AlexNet'):
+    def _preprocess(self, x):
+        # the mean image varies over pixels, so it cannot be folded into conv1's per-channel bias
+        with tf.name_scope('preprocess'):
+            data = tf.cast(x, tf.float32) - tf.constant(self.mean_image)
+            if self.backbone.in_size != self.in_size:
+                data = tf.image.resize_bilinear(data, [self.backbone.in_size, self.backbone.in_size])
+            return data
+
+    def _build_network(self, data):
+        with tf.name_scope(self.backbone.name):
             # remove [15:23] from the network
-            mynet = MyNet({'data': self.x})
+            mynet = with_mode(self.backbone.network, self.mode)({'data': data}, outcome=self.outcome)
         return mynet
 
     def predict(self, data_x):
         # Forwarding
         return self.sess.run(self.out, feed_dict={self.x: data_x})
 
-    def __image_feature(self, camera_image):
-        # Feature Extractor per camera_image
-        # subtract from mean image
-        # TODO: take care of transpose (self.batch, in_size, in_size, 3)
-        x_batch = np.ndarray((self.batchsize, self.in_size, self.in_size, 3), dtype=np.float32)
-        image = np.asarray(camera_image).astype(np.float32)
-        # image = np.asarray(camera_image).transpose(2, 0, 1)[::-1].astype(np.float32)
-
-        image -= self.mean_image
-
-        x_batch[0] = image
-        x_data = np.asarray(x_batch)
+    def image_features(self, camera_images):
+        # one forward pass for all cameras
+        # each camera_image is a PIL image or a uint8 (in_size, in_size, 3) array
+        batch = np.empty((len(camera_images), self.in_size, self.in_size, 3), dtype=np.uint8)
+        for i, camera_image in enumerate(camera_images):
+            batch[i] = np.asarray(camera_image, dtype=np.uint8)
 
         # make prediction
-        feature = self.predict(x_data).reshape(self.out_dim)
-        return feature * 255.0
-
-    def feature(self, observation, image_feature_count=1):
-        # called by module.py VVC component
-
-        image_features = []
-        depth = []
-
-        for i in range(image_feature_count):
-            image_features.append(self.__image_feature(observation["image"][i]))
-            depth.append(observation["depth"][i])
-
-        if image_feature_count == 1:
-            return np.r_[image_features[0], depth[0]]
-        elif image_feature_count == 4:
-            return np.r_[image_features[0], image_features[1], image_features[2], image_features[3],
-                         depth[0], depth[1], depth[2], depth[3]]
-        else:
-            print('not supported: number of camera')
-            # app_logger.error("not supported: number of camera")
+        return self.predict(batch).reshape(len(camera_images), self.out_dim)
@@ -0,0 +1,68 @@
+import os
+
+from kaffe.tensorflow import Network
+from mynet import AlexNet
+
+DEFAULT_WEIGHTS = './tfalex/mynet.npy'
+
+
+class SeparableNet(Network):
+    '''A depthwise-separable trunk with AlexNet's 6x6x256 output at 227x227.'''
+
+    def setup(self):
+        (self.feed('data')
+             .conv(3, 3, 32, 2, 2, padding='VALID', name='conv1')
+             .separable_conv(3, 3, 64, 1, 1, name='sep2')
+             .max_pool(3, 3, 2, 2, padding='VALID', name='pool2')
+             .separable_conv(3, 3, 128, 1, 1, name='sep3')
+             .max_pool(3, 3, 2, 2, padding='VALID', name='pool3')
+             .separable_conv(3, 3, 256, 1, 1, name='sep4')
+             .max_pool(3, 3, 2, 2, padding='VALID', name='pool4')
+             .separable_conv(3, 3, 256, 1, 1, name='sep5')
+             .max_pool(3, 3, 2, 2, padding='VALID', name='pool5'))
+
+
+class Backbone(object):
+    '''A visual trunk: the network class, its input resolution and output layer.
+    weights: default weights path; None means the network starts from its initializers.
+    quantizable: every weighted layer is a conv or fc layer, which the int8 mixins cover
+    '''
+
+    def __init__(self, name, network, in_size, outcome, weights=None, quantizable=True):
+        self.name = name
+        self.network = network
+        self.in_size = in_size
+        self.outcome = outcome
+        self._weights = weights
+        self.quantizable = quantizable
+
+    @property
+    def weights(self):
+        # a .npy is unpickled whole, fc6/fc7 included, before the unused layers are skipped;
+        # the archive tool/convert_weights.py writes next to it is memory-mapped and read per layer
+        if self._weights is not None and self._weights.endswith('.npy') and os.path.isdir(self._weights[:-4]):
+            return self._weights[:-4]
+        return self._weights
+
+
+BACKBONES = {}
+
+
+def register(backbone):
+    BACKBONES[backbone.name] = backbone
+    return backbone
+
+
+def get_backbone(name):
+    try:
+        return BACKBONES[name]
+    except KeyError:
+        raise KeyError('Unknown backbone: %s (available: %s)' % (name, ', '.join(sorted(BACKBONES))))
+
+
+register(Backbone('alexnet', AlexNet, 227, 'pool5', DEFAULT_WEIGHTS))
+# same weights, camera frames resized to 163x163: pool5 shrinks to 4x4x256
+register(Backbone('alexnet_163', AlexNet, 163, 'pool5', DEFAULT_WEIGHTS))
+# no pretrained weights: for tool/benchmark_backbones.py, or served with --cnn-weights
+# its depthwise and pointwise kernels are not covered by QuantizedNetwork
+register(Backbone('separable', SeparableNet, 227, 'pool5', quantizable=False))
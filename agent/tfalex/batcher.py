@@ -0,0 +1,95 @@
+import Queue
+import time
+from threading import Event, Lock, Thread
+
+import numpy as np
+
+
+class _Request(object):
+    def __init__(self, images):
+        self.images = images
+        self.features = None
+        self.error = None
+        self.done = Event()
+
+
+class BatchingFeatureExtractor(object):
+    '''Merges concurrent image_features calls into batched forward passes.
+
+    The first pending request opens a batch; requests arriving within max_wait
+    seconds join it until max_batch images are collected. Each of the worker
+    threads runs one batch at a time; use one worker per extractor replica.
+    '''
+
+    def __init__(self, extractor, max_batch=16, max_wait=0.005, workers=1):
+        self.extractor = extractor
+        self.in_size = extractor.in_size
+        self.out_dim = extractor.out_dim
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = Queue.Queue()
+        self.batches = 0
+        self.images = 0
+        self.lock = Lock()
+        self.workers = []
+        for i in range(workers):
+            worker = Thread(target=self._run, name='feature-batcher{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def image_features(self, camera_images):
+        request = _Request(camera_images)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.features
+
+    def _collect(self):
+        pending = [self.queue.get()]
+        count = len(pending[0].images)
+        deadline = time.time() + self.max_wait
+        while count < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except Queue.Empty:
+                break
+            pending.append(request)
+            count += len(request.images)
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            images = []
+            for request in pending:
+                images.extend(request.images)
+            try:
+                features = self.extractor.image_features(images)
+            except Exception as e:
+                for request in pending:
+                    request.error = e
+                    request.done.set()
+                continue
+            with self.lock:
+                self.batches += 1
+                self.images += len(images)
+            offset = 0
+            for request in pending:
+                request.features = features[offset:offset + len(request.images)]
+                offset += len(request.images)
+                request.done.set()
+
+    def stats(self):
+        with self.lock:
+            batches, images = self.batches, self.images
+        return {
+            'batches': batches,
+            'images': images,
+            'mean_batch_size': images / float(batches) if batches > 0 else 0.0,
+            'queued': self.queue.qsize(),
+        }
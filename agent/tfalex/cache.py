@@ -0,0 +1,69 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+
+class FeatureCache(object):
+    '''LRU cache of image features keyed by the encoded camera image bytes.
+
+    Agents that stand still, bump into walls or revisit a viewpoint send
+    byte-identical PNGs, so the key is taken before decoding and a hit skips
+    both the decode and the AlexNet pass.
+    '''
+
+    def __init__(self, max_bytes, enabled=True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def key(data):
+        return hashlib.sha1(data).digest()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self.lock:
+            feature = self.entries.pop(key, None)
+            if feature is None:
+                self.misses += 1
+                return None
+            # re-insert as most recently used
+            self.entries[key] = feature
+            self.hits += 1
+            return feature
+
+    def put(self, key, feature):
+        if not self.enabled or feature.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.entries[key] = feature
+            self.nbytes += feature.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / float(lookups) if lookups > 0 else 0.0,
+            }
@@ -1,2 +1,3 @@
 from .transformer import TensorFlowTransformer
-from .network import Network
+from .network import Network, load_weights
+from .archive import load_archive, save_archive
@@ -0,0 +1,63 @@
+import json
+import os
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+ARCHIVE_VERSION = 1
+
+
+def save_archive(data_dict, data_path, float16=False):
+    '''Writes {layer: {param: array}} weights as a directory archive.
+    Each parameter is stored as one raw C-ordered array file next to a JSON
+    manifest holding its shape and dtypes, so that readers can mmap the files
+    and share the page cache instead of unpickling private copies.
+    float16: If true, floating point parameters are stored at half precision.
+    '''
+    if not os.path.exists(data_path):
+        os.makedirs(data_path)
+    params = {}
+    for op_name, op_params in data_dict.iteritems():
+        params[op_name] = {}
+        for param_name, data in op_params.iteritems():
+            data = np.asarray(data)
+            stored = data
+            if float16 and np.issubdtype(data.dtype, np.floating):
+                stored = data.astype(np.float16)
+            filename = '%s__%s.raw' % (op_name, param_name)
+            np.ascontiguousarray(stored).tofile(os.path.join(data_path, filename))
+            params[op_name][param_name] = {
+                'file': filename,
+                'shape': list(data.shape),
+                'dtype': data.dtype.name,
+                'stored_dtype': stored.dtype.name,
+            }
+    manifest = {'version': ARCHIVE_VERSION, 'float16': float16, 'params': params}
+    with open(os.path.join(data_path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def load_archive(data_path):
+    '''Returns the weights of a directory archive as read-only memory maps.
+    Arrays keep their stored dtype; float16 archives are widened by the caller,
+    e.g. when the arrays are fed to float32 variables.
+    '''
+    with open(os.path.join(data_path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest['version'] != ARCHIVE_VERSION:
+        raise ValueError('Unsupported weight archive version: %s' % manifest['version'])
+    data_dict = {}
+    for op_name, op_params in manifest['params'].iteritems():
+        data_dict[op_name] = {}
+        for param_name, entry in op_params.iteritems():
+            shape = tuple(entry['shape'])
+            filename = os.path.join(data_path, entry['file'])
+            if len(shape) == 0:
+                # scalars are not worth a mapping
+                data = np.fromfile(filename, dtype=entry['stored_dtype'])[0]
+            elif int(np.prod(shape)) == 0:
+                data = np.zeros(shape, dtype=entry['stored_dtype'])
+            else:
+                data = np.memmap(filename, dtype=entry['stored_dtype'], mode='r', shape=shape)
+            data_dict[op_name][param_name] = data
+    return data_dict
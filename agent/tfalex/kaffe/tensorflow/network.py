@@ -1,15 +1,33 @@
+import os
+
 import numpy as np
 import tensorflow as tf
 
+from .archive import load_archive
+
 DEFAULT_PADDING = 'SAME'
 
 
+def load_weights(data_path):
+    '''Returns the {layer: {param: array}} weights stored at data_path.
+    A directory is read as an archive written by save_archive, whose arrays are
+    memory-mapped read-only instead of unpickled; anything else is taken to be
+    a single pickled .npy dict.
+    '''
+    if os.path.isdir(data_path):
+        return load_archive(data_path)
+    return np.load(data_path).item()
+
+
 def layer(op):
     '''Decorator for composable network layers.'''
 
     def layer_decorated(self, *args, **kwargs):
         # Automatically set a name if not provided.
         name = kwargs.setdefault('name', self.get_unique_name(op.__name__))
+        # Layers past the requested output are never built.
+        if self.is_complete():
+            return self
         # Figure out the layer inputs.
         if len(self.terminals) == 0:
             raise RuntimeError('No input variables found for layer %s.' % name)
@@ -31,15 +49,19 @@ def layer(op):
 
 class Network(object):
 
-    def __init__(self, inputs, trainable=True):
+    def __init__(self, inputs, trainable=True, outcome=None):
         # The input nodes for this network
         self.inputs = inputs
+        # Name of the last layer to build; None builds the whole network
+        self.outcome = outcome
         # The current list of terminal nodes
         self.terminals = []
         # Mapping from layer names to layers
         self.layers = dict(inputs)
         # If true, the resulting variables are set as trainable
         self.trainable = trainable
+        # Variables created by make_var
+        self.variables = []
         # Switch variable for dropout
         self.use_dropout = tf.placeholder_with_default(tf.constant(1.0),
                                                        shape=[],
@@ -50,28 +72,47 @@ class Network(object):
         '''Construct the network. '''
         raise NotImplementedError('Must be implemented by the subclass.')
 
+    def is_complete(self):
+        '''Returns True once the requested output layer has been built.'''
+        return self.outcome is not None and self.outcome in self.layers
+
     def load(self, data_path, session, ignore_missing=False):
         '''Load network weights.
-        data_path: The path to the numpy-serialized network weights
+        data_path: The path to the numpy-serialized network weights, or a directory
+                   written by save_archive. None keeps the initializers' values.
         session: The current TensorFlow session
         ignore_missing: If true, serialized weights for missing layers are ignored.
+        Weights of layers that were not built (past the outcome) are always skipped;
+        only an archive saves their memory, a .npy is unpickled whole first.
+
+        Every variable of the network is initialized by a single run of the existing
+        initializer ops, with the serialized weights fed in place of their initial
+        values (float16 archives are widened on feed). No assign ops or weight
+        constants are added to the graph.
         '''
-        data_dict = np.load(data_path).item()
-        for op_name in data_dict:
-            with tf.variable_scope(op_name, reuse=True):
-                for param_name, data in data_dict[op_name].iteritems():
-                    try:
-                        var = tf.get_variable(param_name)
-                        session.run(var.assign(data))
-                    except ValueError:
-                        if not ignore_missing:
-                            raise
+        data_dict = load_weights(data_path) if data_path is not None else {}
+        feed_dict = {}
+        with session.graph.as_default():
+            for op_name in data_dict:
+                if op_name not in self.layers:
+                    continue
+                with tf.variable_scope(op_name, reuse=True):
+                    for param_name, data in data_dict[op_name].iteritems():
+                        try:
+                            var = tf.get_variable(param_name)
+                            feed_dict[var.initial_value] = data
+                        except ValueError:
+                            if not ignore_missing:
+                                raise
+        session.run([var.initializer for var in self.variables], feed_dict=feed_dict)
 
     def feed(self, *args):
         '''Set the input(s) for the next operation by replacing the terminal nodes.
         The arguments can be either layer names or the actual layers.
         '''
         assert len(args) != 0
+        if self.is_complete():
+            return self
         self.terminals = []
         for fed_layer in args:
             if isinstance(fed_layer, basestring):
@@ -95,7 +136,14 @@ class Network(object):
 
     def make_var(self, name, shape):
         '''Creates a new TensorFlow variable.'''
-        return tf.get_variable(name, shape, trainable=self.trainable)
+        var = tf.get_variable(name, shape, trainable=self.trainable)
+        self.variables.append(var)
+        return var
+
+    def quantize_input(self, input):
+        '''Hook applied to the input of weighted layers inside their variable scope.
+        The identity here; quantized networks override it.'''
+        return input
 
     def validate_padding(self, padding):
         '''Verifies that the padding is one of the supported ones.'''
@@ -124,6 +172,7 @@ class Network(object):
         # Convolution for a given input and kernel
         convolve = lambda i, k: tf.nn.conv2d(i, k, [1, s_h, s_w, 1], padding=padding)
         with tf.variable_scope(name) as scope:
+            input = self.quantize_input(input)
             kernel = self.make_var('weights', shape=[k_h, k_w, c_i / group, c_o])
             if group == 1:
                 # This is the common-case. Convolve the input without any further complications.
@@ -147,6 +196,38 @@ class Network(object):
                 output = tf.nn.relu(output, name=scope.name)
             return output
 
+    @layer
+    def separable_conv(self,
+                       input,
+                       k_h,
+                       k_w,
+                       c_o,
+                       s_h,
+                       s_w,
+                       name,
+                       relu=True,
+                       padding=DEFAULT_PADDING,
+                       depth_multiplier=1,
+                       biased=True):
+        # Verify that the padding is acceptable
+        self.validate_padding(padding)
+        # Get the number of channels in the input
+        c_i = input.get_shape()[-1]
+        with tf.variable_scope(name) as scope:
+            input = self.quantize_input(input)
+            # A per-channel spatial filter followed by a 1x1 convolution mixing the channels
+            depthwise = self.make_var('depthwise_weights', shape=[k_h, k_w, c_i, depth_multiplier])
+            pointwise = self.make_var('pointwise_weights', shape=[1, 1, c_i * depth_multiplier, c_o])
+            output = tf.nn.separable_conv2d(input, depthwise, pointwise, [1, s_h, s_w, 1], padding=padding)
+            # Add the biases
+            if biased:
+                biases = self.make_var('biases', [c_o])
+                output = tf.nn.bias_add(output, biases)
+            if relu:
+                # ReLU non-linearity
+                output = tf.nn.relu(output, name=scope.name)
+            return output
+
     @layer
     def relu(self, input, name):
         return tf.nn.relu(input, name=name)
@@ -198,6 +279,7 @@ class Network(object):
                 feed_in = tf.reshape(input, [-1, dim])
             else:
                 feed_in, dim = (input, input_shape[-1].value)
+            feed_in = self.quantize_input(feed_in)
             weights = self.make_var('weights', shape=[dim, num_out])
             biases = self.make_var('biases', [num_out])
             op = tf.nn.relu_layer if relu else tf.nn.xw_plus_b
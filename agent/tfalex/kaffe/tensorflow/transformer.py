@@ -7,6 +7,7 @@ from ..transformers import (DataInjector, DataReshaper, NodeRenamer, ReLUFuser,
                             BatchNormScaleBiasFuser, BatchNormPreprocessor, ParameterNamer)
 
 from . import network
+from .archive import save_archive
 
 
 def get_padding_type(kernel_params, input_shape, output_shape):
@@ -276,6 +277,10 @@ class TensorFlowTransformer(object):
             self.params = {node.name: node.data for node in self.graph.nodes if node.data}
         return self.params
 
+    def save_data(self, data_path, float16=False):
+        '''Writes the transformed parameters as a memory-mappable archive directory.'''
+        save_archive(self.transform_data(), data_path, float16=float16)
+
     def transform_source(self):
         if self.source is None:
             mapper = TensorFlowMapper(self.graph)
@@ -0,0 +1,69 @@
+from threading import Lock
+
+import tensorflow as tf
+
+from FeatureExtractor import FeatureExtractor
+
+
+class FeatureExtractorPool(object):
+    '''K FeatureExtractor replicas, each with its own graph, session and thread budget.
+
+    A single session with default thread pools leaves cores idle while request
+    threads queue on it. Requests go to the replica with the fewest in-flight
+    calls; the pool exposes the same feature()/features()/image_features() interface.
+    '''
+
+    def __init__(self, replicas, intra_op_threads=0, sess_config=None, **kwargs):
+        self.replicas = []
+        for i in range(replicas):
+            config = tf.ConfigProto()
+            if sess_config is not None:
+                config.CopyFrom(sess_config)
+            if intra_op_threads > 0:
+                config.intra_op_parallelism_threads = intra_op_threads
+                config.inter_op_parallelism_threads = 1
+            self.replicas.append(FeatureExtractor(sess_name='AlexNet{}'.format(i), sess_config=config, **kwargs))
+        self.loads = [0] * replicas
+        self.lock = Lock()
+
+        first = self.replicas[0]
+        self.in_size = first.in_size
+        self.out_dim = first.out_dim
+        self.sparse = first.sparse
+        self.feature_cache = first.feature_cache
+
+    def _acquire(self):
+        # least-loaded first
+        with self.lock:
+            index = self.loads.index(min(self.loads))
+            self.loads[index] += 1
+        return index
+
+    def _release(self, index):
+        with self.lock:
+            self.loads[index] -= 1
+
+    def image_features(self, camera_images):
+        index = self._acquire()
+        try:
+            return self.replicas[index].image_features(camera_images)
+        finally:
+            self._release(index)
+
+    def feature(self, observation, image_feature_count=None):
+        index = self._acquire()
+        try:
+            return self.replicas[index].feature(observation, image_feature_count)
+        finally:
+            self._release(index)
+
+    def features(self, observations, image_feature_count=None):
+        index = self._acquire()
+        try:
+            return self.replicas[index].features(observations, image_feature_count)
+        finally:
+            self._release(index)
+
+    def stats(self):
+        with self.lock:
+            return {'replicas': len(self.replicas), 'in_flight': list(self.loads)}
@@ -0,0 +1,101 @@
+import numpy as np
+import tensorflow as tf
+
+QMAX = 127
+
+
+class CalibratingNetwork(object):
+    '''Mixin recording the input tensor of every weighted layer for calibration.'''
+
+    def quantize_input(self, input):
+        if not hasattr(self, 'weighted_inputs'):
+            self.weighted_inputs = {}
+        self.weighted_inputs[tf.get_variable_scope().name] = input
+        return input
+
+
+class QuantizedNetwork(object):
+    '''Mixin storing weights as per-output-channel int8 with float32 scales.
+
+    The inputs of weighted layers are rounded to 8 bits over the calibrated
+    range (input_min, input_max) of each layer, so the features carry the error
+    of int8 inference while the arithmetic stays in float32. The dequantization
+    and fake_quant ops make it slower than the float mode: it measures the
+    drift of the int8 weights and is not a serving mode.
+    '''
+
+    def make_var(self, name, shape):
+        if name != 'weights':
+            return super(QuantizedNetwork, self).make_var(name, shape)
+        quantized = tf.get_variable('weights_q', shape, dtype=tf.int8, trainable=False,
+                                    initializer=tf.zeros_initializer())
+        scale = tf.get_variable('weights_scale', [shape[-1]], trainable=False,
+                                initializer=tf.ones_initializer())
+        self.variables += [quantized, scale]
+        return tf.cast(quantized, tf.float32) * scale
+
+    def quantize_input(self, input):
+        input_min = tf.get_variable('input_min', [], trainable=False, initializer=tf.zeros_initializer())
+        input_max = tf.get_variable('input_max', [], trainable=False, initializer=tf.ones_initializer())
+        self.variables += [input_min, input_max]
+        return tf.fake_quant_with_min_max_vars(input, input_min, input_max, num_bits=8)
+
+
+MODES = {
+    'float': None,
+    'calibrate': CalibratingNetwork,
+    'int8': QuantizedNetwork,
+}
+
+_mixed = {}
+
+
+def with_mode(network, mode):
+    '''Returns the network class combined with the mixin of the given mode.'''
+    mixin = MODES[mode]
+    if mixin is None:
+        return network
+    key = (network, mode)
+    if key not in _mixed:
+        _mixed[key] = type(mixin.__name__.replace('Network', network.__name__), (mixin, network), {})
+    return _mixed[key]
+
+
+def calibrate(extractor, image_batches):
+    '''Returns {layer: (min, max)} of the weighted layer inputs over the batches.
+    extractor: FeatureExtractor built with mode='calibrate'
+    '''
+    inputs = extractor.net.weighted_inputs
+    names = sorted(inputs)
+    ranges = {}
+    for images in image_batches:
+        batch = np.array([np.asarray(image, dtype=np.uint8) for image in images])
+        values = extractor.sess.run([inputs[name] for name in names], feed_dict={extractor.x: batch})
+        for name, value in zip(names, values):
+            low, high = ranges.get(name, (0.0, 0.0))
+            ranges[name] = (min(low, float(value.min())), max(high, float(value.max())))
+    return ranges
+
+
+def quantize_weights(data_dict, ranges):
+    '''Converts float weights of the calibrated layers to per-channel int8.
+    Returns a {layer: {param: array}} dict loadable by a QuantizedNetwork.
+    '''
+    quantized = {}
+    for op_name, (input_min, input_max) in ranges.items():
+        quantized[op_name] = {
+            'input_min': np.float32(input_min),
+            'input_max': np.float32(input_max),
+        }
+        for param_name, data in data_dict[op_name].items():
+            data = np.asarray(data, dtype=np.float32)
+            if param_name != 'weights':
+                quantized[op_name][param_name] = data
+                continue
+            # symmetric per output channel; the last axis is c_o for conv and fc
+            axes = tuple(range(data.ndim - 1))
+            scale = np.abs(data).max(axis=axes) / QMAX
+            scale[scale == 0] = 1.0
+            quantized[op_name]['weights_q'] = np.clip(np.round(data / scale), -QMAX, QMAX).astype(np.int8)
+            quantized[op_name]['weights_scale'] = scale.astype(np.float32)
+    return quantized
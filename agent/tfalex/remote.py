@@ -0,0 +1,62 @@
+import httplib
+import urlparse
+from threading import local
+
+import msgpack
+import numpy as np
+
+from FeatureExtractor import BaseFeatureExtractor
+
+
+class RemoteFeatureExtractor(BaseFeatureExtractor):
+    '''Client of feature_server.py, the standalone AlexNet service.
+
+    image_features takes the encoded camera images (PNG bytes) as they arrive
+    in the request payload, so the agent server does not decode them at all.
+    '''
+
+    def __init__(self, url, sparse=False, feature_cache=None, timeout=30):
+        parsed = urlparse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self.sparse = sparse
+        self.feature_cache = feature_cache
+        # one keep-alive connection per request thread
+        self.connections = local()
+
+        info = msgpack.unpackb(self._post('/info', msgpack.packb({})))
+        self.out_dim = info['out_dim']
+        self.in_size = info['in_size']
+
+    def _connection(self):
+        connection = getattr(self.connections, 'connection', None)
+        if connection is None:
+            connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.connections.connection = connection
+        return connection
+
+    def _post(self, path, body):
+        headers = {'Content-Type': 'application/x-msgpack'}
+        for retry in range(2):
+            connection = self._connection()
+            try:
+                connection.request('POST', self.path + path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (httplib.HTTPException, IOError):
+                # the service may have closed an idle connection; reconnect once
+                connection.close()
+                self.connections.connection = None
+                if retry > 0:
+                    raise
+        if response.status != 200:
+            raise IOError('feature service returned {}: {}'.format(response.status, data))
+        return data
+
+    def image_features(self, camera_images):
+        body = msgpack.packb({'image': list(camera_images)})
+        dat = msgpack.unpackb(self._post('/feature', body))
+        return np.frombuffer(dat['data'], dtype=np.float32).reshape(dat['shape'])
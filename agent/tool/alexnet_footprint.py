@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Measures FeatureExtractor startup time and resident memory per outcome layer.
+
+Each outcome is built in a fresh process so the numbers do not leak into
+each other. Run from agent/:
+
+    python -m tool.alexnet_footprint --outcomes prob pool5
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024.0
+    return peak_rss_mb()
+
+
+def measure(outcome):
+    import tensorflow as tf
+    from tfalex.FeatureExtractor import FeatureExtractor
+
+    baseline = rss_mb()
+    start = time.time()
+    config = tf.ConfigProto(device_count={'GPU': 0})
+    FeatureExtractor(sess_name='AlexNet', sess_config=config, outcome=outcome)
+    elapsed = time.time() - start
+    return {'outcome': outcome, 'startup_sec': elapsed, 'peak_rss_mb': peak_rss_mb(),
+            'rss_mb': rss_mb(), 'extractor_rss_mb': rss_mb() - baseline}
+
+
+def main(args):
+    if args.child is not None:
+        print(json.dumps(measure(args.child)))
+        return
+
+    print('outcome,startup_sec,peak_rss_mb,rss_mb,extractor_rss_mb')
+    for outcome in args.outcomes:
+        output = subprocess.check_output([sys.executable, '-m', 'tool.alexnet_footprint', '--child', outcome])
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        print('{outcome},{startup_sec:.2f},{peak_rss_mb:.0f},{rss_mb:.0f},{extractor_rss_mb:.0f}'.format(**result))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AlexNet memory and startup report')
+    parser.add_argument('--outcomes', nargs='+', default=['prob', 'pool5'], help='layers to compare')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    main(args)
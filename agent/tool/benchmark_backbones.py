@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""CPU throughput and feature dimension of every registered backbone.
+
+Uses recorded camera frames when --records is given and random frames
+otherwise. Run from agent/:
+
+    python -m tool.benchmark_backbones [--records DIR] [--backbones alexnet separable]
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from tfalex.FeatureExtractor import FeatureExtractor
+from tfalex.backbones import BACKBONES
+
+
+def load_frames(directory, count, in_size):
+    if directory is None:
+        return list(np.random.randint(0, 256, size=(count, in_size, in_size, 3)).astype(np.uint8))
+    from server import unpack
+    from tool.recorder import load_payloads
+    frames = []
+    for body in load_payloads(directory, limit=count):
+        _, observation, _, _, _ = unpack(body)
+        frames.extend(np.asarray(image, dtype=np.uint8) for image in observation['image'])
+    return frames[:count]
+
+
+def images_per_sec(extractor, frames, batch_size, repeat):
+    groups = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    extractor.image_features(groups[0])
+    count = 0
+    start = time.time()
+    for _ in range(repeat):
+        for images in groups:
+            extractor.image_features(images)
+            count += len(images)
+    return count / (time.time() - start)
+
+
+def main(args):
+    config = tf.ConfigProto(device_count={'GPU': 0},
+                            intra_op_parallelism_threads=args.threads,
+                            inter_op_parallelism_threads=1 if args.threads > 0 else 0)
+    frames = load_frames(args.records, args.frames, 227)
+
+    print('backbone,input,feature_dim,pretrained,' + ','.join(
+        'batch{}_images_per_sec'.format(size) for size in args.batch_sizes))
+    for name in args.backbones:
+        backbone = BACKBONES[name]
+        # throughput does not depend on the weights
+        extractor = FeatureExtractor(sess_name=name, sess_config=config, backbone=name, require_weights=False)
+        rates = [images_per_sec(extractor, frames, size, args.repeat) for size in args.batch_sizes]
+        print('{},{},{},{},{}'.format(name, backbone.in_size, extractor.out_dim, backbone.weights is not None,
+                                      ','.join('{:.1f}'.format(rate) for rate in rates)))
+        extractor.sess.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='backbone throughput benchmark')
+    parser.add_argument('--backbones', nargs='+', default=sorted(BACKBONES), choices=sorted(BACKBONES))
+    parser.add_argument('--records', default=None, type=str, help='directory written by server.py --record')
+    parser.add_argument('--frames', default=64, type=int, help='number of frames per pass')
+    parser.add_argument('--batch-sizes', nargs='+', default=[1, 16], type=int)
+    parser.add_argument('--repeat', default=3, type=int, help='passes over the frames')
+    parser.add_argument('--threads', default=0, type=int, help='intra-op threads, 0 uses the TensorFlow default')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Replays recorded payloads over HTTP and over the stream protocol.
+
+Start the server with --stream-port, then run from agent/:
+
+    python -m tool.benchmark_stream --records DIR --agents 4
+"""
+import argparse
+import httplib
+import time
+from threading import Thread
+
+import numpy as np
+
+from serving.stream import StreamClient
+from tool.recorder import load_payloads
+
+
+class HttpClient(object):
+    # one keep-alive connection, as the Unity client would use at best
+    def __init__(self, host, port):
+        self.connection = httplib.HTTPConnection(host, port)
+
+    def call(self, kind, identifier=None, body=None, payload_format='png'):
+        self.connection.request('POST', '/{}/{}'.format(kind, identifier), body,
+                                {'X-LIS-Payload': payload_format})
+        return self.connection.getresponse().read()
+
+    def close(self):
+        self.connection.close()
+
+
+def run_agent(client, identifier, bodies, latencies):
+    client.call('create', identifier, bodies[0])
+    for body in bodies[1:]:
+        start = time.time()
+        client.call('step', identifier, body)
+        latencies.append(time.time() - start)
+    client.close()
+
+
+def replay(make_client, prefix, agents, bodies):
+    latencies = []
+    threads = [Thread(target=run_agent, args=(make_client(), '{}{}'.format(prefix, i), bodies, latencies))
+               for i in range(agents)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    latencies = np.array(latencies) * 1000.0
+    return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main(args):
+    bodies = list(load_payloads(args.records, limit=args.steps + 1))
+    if len(bodies) < 2:
+        print('not enough recorded payloads in {}'.format(args.records))
+        return
+
+    print('protocol,agents,steps_per_sec,p50_ms,p99_ms')
+    protocols = [
+        ('http', lambda: HttpClient(args.host, args.port)),
+        ('stream', lambda: StreamClient(args.host, args.stream_port)),
+    ]
+    for name, make_client in protocols:
+        rate, p50, p99 = replay(make_client, 'bench-{}-'.format(name), args.agents, bodies)
+        print('{},{},{:.1f},{:.2f},{:.2f}'.format(name, args.agents, rate, p50, p99))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP vs stream protocol benchmark')
+    parser.add_argument('--records', required=True, type=str, help='directory written by server.py --record')
+    parser.add_argument('--host', default='localhost', type=str, help='Server hostname')
+    parser.add_argument('--port', default=8765, type=int, help='HTTP port of server.py')
+    parser.add_argument('--stream-port', default=8767, type=int, help='--stream-port of server.py')
+    parser.add_argument('--agents', default=4, type=int, help='concurrent simulated agents')
+    parser.add_argument('--steps', default=200, type=int, help='steps per agent')
+    args = parser.parse_args()
+
+    main(args)
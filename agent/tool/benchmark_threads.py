@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Steps per second of server.py under several thread-budget policies.
+
+Starts a server for every policy, waits for /health, drives it with the
+simulated environments of tool.stress_test and stops it again. Run from
+agent/:
+
+    python -m tool.benchmark_threads --policies none balanced cnn a3c 1:1:1
+"""
+import argparse
+import httplib
+import subprocess
+import sys
+import time
+from threading import Thread
+
+import numpy as np
+
+from serving.threads import ThreadPlan, parse_cpus
+from tool.stress_test import Report, environment, synthetic_payloads
+
+
+def wait_until_healthy(host, port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = httplib.HTTPConnection(host, port, timeout=5)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return True
+        except (httplib.HTTPException, IOError):
+            pass
+        time.sleep(1.0)
+    return False
+
+
+def run(args, policy, payloads):
+    command = [sys.executable, 'server.py', '--port', str(args.port), '--workers', str(args.environments),
+               '--cnn-replicas', str(args.cnn_replicas), '--logdir', 'board/threads-{}'.format(policy)]
+    if policy != 'none':
+        command += ['--thread-policy', policy]
+    if args.cpus is not None:
+        command += ['--cpus', args.cpus]
+    server = subprocess.Popen(command)
+    try:
+        if not wait_until_healthy('localhost', args.port, args.startup_timeout):
+            return None
+        report = Report()
+        threads = [Thread(target=environment, args=(args, i, payloads, report)) for i in range(args.environments)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        steps = report.counts.get('step ok', 0)
+        errors = sum(count for key, count in report.counts.items() if not key.endswith(' ok'))
+        latencies = np.array(report.latencies or [0.0]) * 1000.0
+        return steps / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99), errors
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(args):
+    payloads = synthetic_payloads(args.payloads)
+    cpus = parse_cpus(args.cpus) if args.cpus is not None else None
+    print('policy,cnn_replicas,cnn_threads,a3c_threads,decode_workers,steps_per_sec,p50_ms,p99_ms,errors')
+    for policy in args.policies:
+        if policy == 'none':
+            split = '{},default,default,default'.format(args.cnn_replicas)
+        else:
+            plan = ThreadPlan(policy, cpus, args.cnn_replicas)
+            split = '{},{},{},{}'.format(plan.cnn_replicas, plan.cnn_threads, plan.a3c_intra_threads,
+                                         plan.decode_workers)
+        result = run(args, policy, payloads)
+        if result is None:
+            print('{},{},failed to start,,,'.format(policy, split))
+            continue
+        print('{},{},{:.1f},{:.1f},{:.1f},{}'.format(policy, split, *result))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='thread-budget policy benchmark')
+    parser.add_argument('--policies', nargs='+', default=['none', 'balanced', 'cnn', 'a3c', 'io'],
+                        help='policies of serving/threads.py, "none" keeps the TensorFlow defaults')
+    parser.add_argument('--cpus', default=None, type=str, help='cores the server is pinned to, e.g. 0-7')
+    parser.add_argument('--cnn-replicas', default=2, type=int, help='AlexNet replicas of the server')
+    parser.add_argument('--port', default=8790, type=int, help='port of the benchmarked server')
+    parser.add_argument('--environments', default=8, type=int, help='concurrent simulated environments')
+    parser.add_argument('--episodes', default=2, type=int, help='episodes per environment')
+    parser.add_argument('--steps', default=100, type=int, help='steps per episode')
+    parser.add_argument('--payloads', default=32, type=int, help='distinct observations to cycle through')
+    parser.add_argument('--startup-timeout', default=300, type=float, help='seconds to wait for /health')
+    args = parser.parse_args()
+    # read by tool.stress_test.environment
+    args.host = 'localhost'
+    args.churn = 0
+    args.timeout = 120
+
+    main(args)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""Converts the pickled AlexNet weights into a memory-mappable archive.
+
+The archive is a directory of raw per-parameter arrays plus manifest.json.
+Servers loading it mmap the arrays read-only, so processes on one host share
+the same page-cache pages. Run from agent/:
+
+    python -m tool.convert_weights tfalex/mynet.npy tfalex/mynet [--float16]
+    python server.py --cnn-weights tfalex/mynet
+"""
+import argparse
+
+from tfalex.kaffe.tensorflow import load_weights, save_archive
+
+
+def main(args):
+    data_dict = load_weights(args.source)
+    save_archive(data_dict, args.destination, float16=args.float16)
+    for op_name in sorted(data_dict):
+        for param_name, data in sorted(data_dict[op_name].items()):
+            print('{}/{}: {} {}'.format(op_name, param_name, data.shape, data.dtype))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert network weights')
+    parser.add_argument('source', type=str, help='pickled .npy weights or an existing archive')
+    parser.add_argument('destination', type=str, help='output archive directory')
+    parser.add_argument('--float16', action='store_true', help='store floating point parameters at half precision')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Reports pool5 sparsity on recorded episodes and what the sparse path saves.
+
+Record episodes with `python server.py --record DIR`, then run from agent/:
+
+    python -m tool.feature_sparsity --records DIR
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from ml.sparse import SparseFeature, stack
+from server import unpack
+from tfalex.FeatureExtractor import FeatureExtractor
+from tool.recorder import load_payloads
+
+ROLLOUT_SIZE = 50
+HIDDEN_UNITS = 256
+
+
+def measure_matmul(features, repeat):
+    dim = features[0].dim
+    graph = tf.Graph()
+    with graph.as_default():
+        weights = tf.Variable(tf.random_normal([dim, HIDDEN_UNITS]))
+        dense_ph = tf.placeholder(tf.float32, [None, dim])
+        sparse_ph = tf.sparse_placeholder(tf.float32)
+        dense_out = tf.matmul(dense_ph, weights)
+        sparse_out = tf.sparse_tensor_dense_matmul(sparse_ph, weights)
+        init = tf.global_variables_initializer()
+    sess = tf.Session(graph=graph)
+    sess.run(init)
+
+    dense_batch = np.array([f.to_dense() for f in features])
+    sparse_batch = stack(features)
+    timings = {}
+    for name, out, feed in (('dense', dense_out, {dense_ph: dense_batch}),
+                            ('sparse', sparse_out, {sparse_ph: sparse_batch})):
+        sess.run(out, feed_dict=feed)
+        start = time.time()
+        for _ in range(repeat):
+            sess.run(out, feed_dict=feed)
+        timings[name] = (time.time() - start) / repeat
+    return timings
+
+
+def main(args):
+    config = tf.ConfigProto(gpu_options=tf.GPUOptions(visible_device_list=args.gpu, allow_growth=True))
+    feature_extractor = FeatureExtractor(sess_name='AlexNet', sess_config=config)
+
+    pool5 = []
+    features = []
+    for body in load_payloads(args.records, limit=args.limit):
+        _, observation, _, _, _ = unpack(body)
+        feature = feature_extractor.feature(observation)
+        pool5.append(SparseFeature.from_dense(feature[:feature_extractor.out_dim]))
+        features.append(SparseFeature.from_dense(feature))
+    if len(features) == 0:
+        print('no recorded frames found in {}'.format(args.records))
+        return
+
+    pool5_density = np.array([f.density for f in pool5])
+    density = np.array([f.density for f in features])
+    dim = features[0].dim
+    dense_bytes = dim * 4
+    sparse_bytes = np.mean([f.nbytes for f in features])
+
+    print('frames: {}'.format(len(features)))
+    print('pool5 density: mean {:.4f}, min {:.4f}, max {:.4f}'.format(
+        pool5_density.mean(), pool5_density.min(), pool5_density.max()))
+    print('observation density (pool5 + depth): mean {:.4f}'.format(density.mean()))
+    print('bytes per observation: dense {}, sparse {:.0f} ({:.1f}x)'.format(
+        dense_bytes, sparse_bytes, dense_bytes / sparse_bytes))
+    print('bytes per rollout of {}: dense {}, sparse {:.0f}'.format(
+        ROLLOUT_SIZE, dense_bytes * ROLLOUT_SIZE, sparse_bytes * ROLLOUT_SIZE))
+    print('input layer MACs per observation: dense {}, sparse {:.0f}'.format(
+        dim * HIDDEN_UNITS, density.mean() * dim * HIDDEN_UNITS))
+
+    for size in (1, ROLLOUT_SIZE):
+        batch = features[:size]
+        timings = measure_matmul(batch, args.repeat)
+        print('input layer time, batch {}: dense {:.3f} ms, sparse {:.3f} ms'.format(
+            len(batch), timings['dense'] * 1000, timings['sparse'] * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pool5 sparsity report')
+    parser.add_argument('--records', required=True, type=str, help='directory written by server.py --record')
+    parser.add_argument('--limit', default=None, type=int, help='maximum number of frames to read')
+    parser.add_argument('--repeat', default=100, type=int, help='timing repetitions')
+    parser.add_argument('--gpu', default='-1', type=str, help='Gpu id')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Builds the int8 AlexNet trunk from recorded frames and validates it.
+
+Calibrates the input range of conv1-conv5 on recorded camera frames,
+writes per-channel int8 weights as an archive, then reports pool5 drift and
+throughput of the int8 mode against float32. The int8 mode simulates the
+quantization error in float32, so it is slower than float32 and the servers
+do not offer it. Run from agent/:
+
+    python -m tool.quantize_alexnet --records DIR --output tfalex/mynet_int8
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from server import unpack
+from tfalex.FeatureExtractor import FeatureExtractor
+from tfalex.kaffe.tensorflow import load_weights, save_archive
+from tfalex.quantize import calibrate, quantize_weights
+from tool.recorder import load_payloads
+
+
+def load_frames(directory, limit):
+    frames = []
+    for body in load_payloads(directory, limit=limit):
+        _, observation, _, _, _ = unpack(body)
+        frames.extend(np.asarray(image, dtype=np.uint8) for image in observation['image'])
+    return frames
+
+
+def batches(frames, size):
+    return [frames[i:i + size] for i in range(0, len(frames), size)]
+
+
+def throughput(extractor, frames, batch_size, repeat):
+    groups = batches(frames, batch_size)
+    extractor.image_features(groups[0])
+    start = time.time()
+    count = 0
+    for _ in range(repeat):
+        for images in groups:
+            extractor.image_features(images)
+            count += len(images)
+    return count / (time.time() - start)
+
+
+def main(args):
+    config = tf.ConfigProto(gpu_options=tf.GPUOptions(visible_device_list=args.gpu, allow_growth=True))
+    frames = load_frames(args.records, args.limit)
+    if len(frames) < 2:
+        print('not enough recorded frames in {}'.format(args.records))
+        return
+    calibration = frames[:args.calibration_frames]
+    validation = frames[args.calibration_frames:] or frames
+
+    reference = FeatureExtractor(sess_name='AlexNet', sess_config=config, weights=args.weights, mode='calibrate')
+    ranges = calibrate(reference, batches(calibration, args.batch_size))
+    save_archive(quantize_weights(load_weights(args.weights), ranges), args.output)
+    print('calibrated on {} frames, wrote {}'.format(len(calibration), args.output))
+    for name in sorted(ranges):
+        print('  {} input range: [{:.3f}, {:.3f}]'.format(name, ranges[name][0], ranges[name][1]))
+
+    quantized = FeatureExtractor(sess_name='AlexNetInt8', sess_config=config, weights=args.output, mode='int8')
+
+    errors, cosines, max_diffs, agreement = [], [], [], []
+    for images in batches(validation, args.batch_size):
+        expected = reference.image_features(images)
+        actual = quantized.image_features(images)
+        for e, a in zip(expected, actual):
+            norm = np.linalg.norm(e)
+            errors.append(np.linalg.norm(a - e) / norm if norm > 0 else 0.0)
+            denominator = norm * np.linalg.norm(a)
+            cosines.append(np.dot(e, a) / denominator if denominator > 0 else 1.0)
+            max_diffs.append(np.abs(a - e).max())
+            agreement.append(np.mean((e > 0) == (a > 0)))
+
+    print('pool5 drift on {} validation frames:'.format(len(validation)))
+    print('  relative L2 error: mean {:.4f}, max {:.4f}'.format(np.mean(errors), np.max(errors)))
+    print('  cosine similarity: mean {:.5f}, min {:.5f}'.format(np.mean(cosines), np.min(cosines)))
+    print('  max abs difference: {:.4f}'.format(np.max(max_diffs)))
+    print('  zero-pattern agreement: {:.4f}'.format(np.mean(agreement)))
+
+    print('throughput (images/sec):')
+    for batch_size in (1, args.batch_size):
+        print('  batch {}: float32 {:.1f}, int8 {:.1f}'.format(
+            batch_size,
+            throughput(reference, validation, batch_size, args.repeat),
+            throughput(quantized, validation, batch_size, args.repeat)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='int8 AlexNet calibration and validation')
+    parser.add_argument('--records', required=True, type=str, help='directory written by server.py --record')
+    parser.add_argument('--output', required=True, type=str, help='int8 weight archive to write')
+    parser.add_argument('--weights', default='./tfalex/mynet.npy', type=str, help='float32 weights')
+    parser.add_argument('--limit', default=1000, type=int, help='maximum number of payloads to read')
+    parser.add_argument('--calibration-frames', default=200, type=int, help='frames used for calibration')
+    parser.add_argument('--batch-size', default=16, type=int, help='forward pass batch size')
+    parser.add_argument('--repeat', default=3, type=int, help='throughput repetitions')
+    parser.add_argument('--gpu', default='-1', type=str, help='Gpu id')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+from threading import Lock
+
+
+class PayloadRecorder(object):
+    """Dumps raw request bodies so that episodes can be replayed offline."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.counts = {}
+        self.lock = Lock()
+
+    def record(self, identifier, kind, body):
+        with self.lock:
+            count = self.counts.get(identifier, 0)
+            self.counts[identifier] = count + 1
+        dirname = os.path.join(self.directory, identifier)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        filename = os.path.join(dirname, '{:08d}_{}.msgpack'.format(count, kind))
+        with open(filename, 'wb') as f:
+            f.write(body)
+
+
+def load_payloads(directory, kinds=('create', 'step'), limit=None):
+    """Yields recorded bodies of the given kinds in recording order."""
+    count = 0
+    for dirname in sorted(glob.glob(os.path.join(directory, '*'))):
+        for filename in sorted(glob.glob(os.path.join(dirname, '*.msgpack'))):
+            kind = os.path.basename(filename)[:-len('.msgpack')].split('_', 1)[1]
+            if kind not in kinds:
+                continue
+            if limit is not None and count >= limit:
+                return
+            with open(filename, 'rb') as f:
+                yield f.read()
+            count += 1
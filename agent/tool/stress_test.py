@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Fires concurrent create/step/reset sequences at a running server.
+
+Every simulated environment runs episodes of --steps steps with its own
+identifier; --churn new identifiers per environment exercise agent growth,
+reclamation and admission control. Payloads are synthetic unless --records
+is given. Reports errors, 503 rejections and malformed responses, then the
+server's /metrics. Run from agent/:
+
+    python server.py --workers 4 --max-workers 8 &
+    python -m tool.stress_test --environments 16 --episodes 3
+"""
+import argparse
+import httplib
+import io
+import json
+import time
+from threading import Lock, Thread
+
+import msgpack
+import numpy as np
+from PIL import Image
+
+from tool.recorder import load_payloads
+
+
+def encode_png(array):
+    buf = io.BytesIO()
+    Image.fromarray(array).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def synthetic_payloads(count, seed=0):
+    random = np.random.RandomState(seed)
+    payloads = []
+    for i in range(count):
+        payloads.append(msgpack.packb({
+            'image': [encode_png(random.randint(0, 256, size=(227, 227, 3)).astype(np.uint8))],
+            'depth': [encode_png(random.randint(0, 256, size=(32, 32)).astype(np.uint8))],
+            'reward': float(i),
+            'rotation': float(random.choice([-10, 0, 10])),
+            'movement': float(random.choice([0, 1])),
+            'scene_num': 0,
+        }))
+    return payloads
+
+
+def reset_payload(finished):
+    return msgpack.packb({'reward': 0.0, 'success': 0, 'failure': 1, 'elapsed': 0, 'finished': finished})
+
+
+class Report(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.counts = {}
+        self.latencies = []
+
+    def add(self, kind, status, elapsed):
+        with self.lock:
+            key = '{} {}'.format(kind, status)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if status == 'ok':
+                self.latencies.append(elapsed)
+
+
+def call(connection, kind, identifier, body):
+    connection.request('POST', '/{}/{}'.format(kind, identifier), body)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def check(kind, status, data):
+    if status == 503:
+        return 'rejected'
+    if status != 200:
+        return 'http{}'.format(status)
+    if kind in ('create', 'step'):
+        try:
+            action = int(data.split('/')[0])
+        except ValueError:
+            return 'malformed'
+        if not -1 <= action < 3:
+            return 'malformed'
+    return 'ok'
+
+
+def environment(args, index, payloads, report):
+    connection = httplib.HTTPConnection(args.host, args.port, timeout=args.timeout)
+    for generation in range(args.churn + 1):
+        identifier = 'stress-{}-{}'.format(index, generation)
+        for episode in range(args.episodes):
+            sequence = [('create', payloads[0])]
+            sequence += [('step', payloads[(i + index) % len(payloads)]) for i in range(args.steps)]
+            sequence.append(('reset', reset_payload(episode == args.episodes - 1)))
+            for kind, body in sequence:
+                start = time.time()
+                try:
+                    status, data = call(connection, kind, identifier, body)
+                    result = check(kind, status, data)
+                except Exception as e:
+                    result = type(e).__name__
+                    connection.close()
+                    connection = httplib.HTTPConnection(args.host, args.port, timeout=args.timeout)
+                report.add(kind, result, time.time() - start)
+                if result == 'rejected' and kind == 'create':
+                    break
+    connection.close()
+
+
+def main(args):
+    if args.records is not None:
+        payloads = list(load_payloads(args.records, limit=args.payloads))
+    else:
+        payloads = synthetic_payloads(args.payloads)
+
+    report = Report()
+    threads = [Thread(target=environment, args=(args, i, payloads, report)) for i in range(args.environments)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    print('{} environments, {:.1f}s'.format(args.environments, elapsed))
+    for key in sorted(report.counts):
+        print('  {}: {}'.format(key, report.counts[key]))
+    if len(report.latencies) > 0:
+        latencies = np.array(report.latencies) * 1000.0
+        print('  latency ms: p50 {:.1f}, p99 {:.1f}, max {:.1f}'.format(
+            np.percentile(latencies, 50), np.percentile(latencies, 99), latencies.max()))
+
+    connection = httplib.HTTPConnection(args.host, args.port, timeout=args.timeout)
+    connection.request('GET', '/metrics')
+    print(json.dumps(json.loads(connection.getresponse().read()), indent=2, sort_keys=True))
+    failures = sum(count for key, count in report.counts.items() if not key.endswith(' ok')
+                   and not key.endswith(' rejected'))
+    if failures > 0:
+        raise SystemExit('{} failed requests'.format(failures))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='concurrent create/step/reset load against server.py')
+    parser.add_argument('--host', default='localhost', type=str, help='Server hostname')
+    parser.add_argument('--port', default=8765, type=int, help='Server port number')
+    parser.add_argument('--environments', default=16, type=int, help='concurrent simulated environments')
+    parser.add_argument('--episodes', default=3, type=int, help='episodes per identifier')
+    parser.add_argument('--steps', default=60, type=int, help='steps per episode')
+    parser.add_argument('--churn', default=1, type=int, help='further identifiers per environment')
+    parser.add_argument('--payloads', default=32, type=int, help='distinct observations to cycle through')
+    parser.add_argument('--records', default=None, type=str, help='replay payloads written by server.py --record')
+    parser.add_argument('--timeout', default=120, type=float, help='seconds per request')
+    args = parser.parse_args()
+
+    main(args)